@@ -2,67 +2,91 @@
 # Modified by:     Danush Shekar, UIC (25 April, 2024) 
 # Description:     Parses PixelAV ouput files and also makes 2D plots of charge deposition in sensor array
 
+import os
 import sys
+import json
+import hashlib
 import numpy as np
 import pandas as pd
 import ROOT
-import matplotlib.pyplot as plt
 import langaus
 import optparse
+from multiprocessing import Pool
+from pixelav_reader import read_header, iter_events, expand_files
+from fast_hist import bin_values, add_binned, make_th1
+from cluster_store import CHUNK_EVENTS, TRUTH_COLUMNS, clear_store, append_chunk, absorb_store, iter_chunks
 
 parser = optparse.OptionParser("usage: %prog [options]\n")
-parser.add_option('-p', '--prodname', dest='filename', help="The name of PixelAV dataset")
+parser.add_option('-p', '--prodname', dest='filename', help="The name of PixelAV dataset (can be a glob over chunk outputs, e.g. 'name_*')")
+parser.add_option('-j', '--cores', dest='cores', type='int', default=os.cpu_count(), help="Number of processes used to parse multiple files")
+parser.add_option('-i', '--incremental', action='store_true', dest='incremental', help="Only fit the max-charge distribution, reusing the per-file histograms and fits cached in Runs/maxCharge_<name>/")
+parser.add_option('--csv', action='store_true', dest='csv', help="Also write the flattened events to recon_<name>.csv")
 options, args = parser.parse_args()
 
 filename = options.filename
+# Output files are named after the dataset, without the glob characters
+outname = filename.replace('*', '').replace('?', '')
+MAX_CHARGE_BINS = (20000, 0, 20000) # Binning of the maxCharge histogram: nbins, min, max [e]
 
 
-def parseFile(filein,tag,nevents=-1):
+def parseFile(filein,store_dir,nevents=-1,block_size=CHUNK_EVENTS):
 
-        with open(filein) as f:
-            lines = f.readlines()
-
-        header = lines.pop(0).strip()
-        pixelstats = lines.pop(0).strip()
+        header, pixelstats = read_header(filein)
 
         print("Header: ", header)
         print("Pixelstats: ", pixelstats)
 
-        clusterctr = 0
-        b_getclusterinfo = False
-        b_geteventinfo = False
-        # instantiate 4-d np array [cluster number, time slice, pixel row, pixel column]
-        events = []
-        cur_slice = []
-        cluster_truth =[]
-
-        for line in lines:
-            ## Get cluster truth information
-            if "<cluster>" in line:
-                clusterctr += 1
-                b_geteventinfo = False
-                b_getclusterinfo = True
-                if(len(cur_slice)!=0):
-                    events.append(np.array(cur_slice))
-                    cur_slice = []
-                continue
-            if b_getclusterinfo:
-                cluster_truth.append(line.strip().split())
-                b_getclusterinfo = False
-            if "time slice 4000.000000 ps" in line:
-                b_geteventinfo = True
-                continue
-            if b_geteventinfo == True:
-                cur_row = line.strip().split()
-                cur_slice.append([float(item) for item in cur_row])
-
-        print("Number of pixel rows = ", len(events[0]))
-        print(np.array(events).shape)
-        print("Number of events = ", clusterctr, " or ", len(events))
-
-
-        arr_truth = np.array(cluster_truth)
-        arr_events = np.array(events)
+        # Events are streamed from the file: only the truth and the maximum pixel charge of every event are
+        # kept in memory, the events are appended block by block to the binary cluster store store_dir
+        max_charge = []
+        cluster_truth = []
+        block = []
+        for truth, pixels in iter_events(filein, nevents=nevents):
+            cluster_truth.append(truth)
+            max_charge.append(np.amax(pixels))
+            block.append(pixels)
+            if len(block) == block_size:
+                append_chunk(store_dir, block, cluster_truth[-block_size:])
+                block = []
+        if block:
+            append_chunk(store_dir, block, cluster_truth[-len(block):])
+
+        # A chunk output still being written by PixelAV can hold no event yet
+        if cluster_truth:
+            print(filein, ": number of events = ", len(cluster_truth), ", shape of an event = ", pixels.shape)
+        else:
+            print(filein, ": no events")
+
+        return np.array(max_charge), np.array(cluster_truth).reshape(len(cluster_truth), len(TRUTH_COLUMNS))
+
+def parseFiles(pattern,tag,nevents=-1,ncores=1):
+
+        # pattern can be a glob matching the chunk outputs of job_submit.py: the files are parsed in a process
+        # pool, each into its own part of the store, and merged in chunk order
+        files = expand_files(pattern)
+        if not files:
+                print("No input files match ", pattern)
+                exit(1)
+        print("Input files: ", files)
+        store_dir = "recon_"+outname
+        clear_store(store_dir)
+        if len(files) == 1:
+            results = [parseFile(files[0], store_dir, nevents)]
+        else:
+            parts = [os.path.join(store_dir, "part_%05d" % iter) for iter in range(len(files))]
+            with Pool(min(ncores, len(files))) as pool:
+                results = pool.starmap(parseFile, [(files[iter], parts[iter], nevents) for iter in range(len(files))])
+            for part in parts:
+                absorb_store(store_dir, part)
+
+        arr_max_charge = np.concatenate([result[0] for result in results])
+        arr_truth = np.concatenate([result[1] for result in results])
+        print("Number of events = ", len(arr_truth))
+
+        if options.csv:
+            #df2 is a df with the reconstructed clusters
+            for iter, (events, truth) in enumerate(iter_chunks(store_dir)):
+                pd.DataFrame(np.asarray(events).reshape(len(events), -1)).to_csv(store_dir+".csv", index=False, mode='w' if iter == 0 else 'a', header=iter == 0)
 
         #convert into pandas DF
         df = {}
@@ -79,42 +103,19 @@ def parseFile(filein,tag,nevents=-1):
         #df['cosPhi'] = np.cos(df['phi'])
         df['cotAlpha'] = df['n_x']/df['n_z']
         df['cotBeta'] = df['n_y']/df['n_z']
-        df.to_csv("labels_"+filename+".csv", index=False)
-
-        return arr_events, arr_truth
-
-def main():
-        
-    i = int(sys.argv[1])
-    tag = "d"+str(i)
-    arr_events, arr_truth = parseFile(filein="Runs/"+filename+".out",tag=tag)
-    original_shape = arr_events.shape
+        df.to_csv("labels_"+outname+".csv", index=False)
 
-    # first_event = arr_events[3] # 2, 3, 6
-
-    # plt.imshow(first_event, cmap='Reds', interpolation='nearest')
-    # plt.colorbar()
-    # plt.show()
-
-    arranged_events = arr_events.reshape(original_shape[0], -1)
-
-    print("The shape of the event array: ", arranged_events.shape)
-    print("The ndim of the event array: ", arranged_events.ndim)
-    print("The dtype of the event array: ", arranged_events.dtype)
-    print("The size of the event array: ", arranged_events.size)
-    print("The max value in the array is: ", np.amax(arranged_events))
-    print("The shape of the truth array: ", arr_truth.shape)
+        return arr_max_charge, arr_truth
 
-    df2 = {}
-    max_val = []
+def fit_max_charge(binned):
+    # Langaus fit of the maxCharge histogram given as (contents, stats) from bin_values; saves the plot and
+    # returns the fit results
     print("Setting up Langaus")
     fit = langaus.LanGausFit()
     print("Setup Langaus")
     canvas = ROOT.TCanvas("cv","cv",1000,800)
-    hist = ROOT.TH1F("maxCharge", "Histogram of maximum total-charge induced in a pixel", 20000, 0, 20000)
-    for iter in range(arranged_events.shape[0]):
-        hist.Fill(np.amax(arranged_events[iter,:]))
-    
+    # Binned with NumPy, ROOT only receives the bin contents
+    hist = make_th1("maxCharge", "Histogram of maximum total-charge induced in a pixel", *MAX_CHARGE_BINS, binned=binned)
 
     myMean = hist.GetMean()
     myRMS = hist.GetRMS()
@@ -128,11 +129,89 @@ def main():
     myLanGausFunction.Draw("same")
     hist.GetXaxis().SetTitle("Charge [e]")
     hist.GetYaxis().SetTitle("Counts")
-    canvas.SaveAs("Runs/Charge_Histogram_"+filename+".png")
+    canvas.SaveAs("Runs/Charge_Histogram_"+outname+".png")
+    print("MPV = ", myMPV)
+    return {'entries': float(np.sum(binned[0])), 'mean': myMean, 'rms': myRMS, 'mpv': myMPV,
+            'parameters': [myLanGausFunction.GetParameter(iter) for iter in range(myLanGausFunction.GetNpar())],
+            'errors': [myLanGausFunction.GetParError(iter) for iter in range(myLanGausFunction.GetNpar())]}
+
+def file_signature(filein):
+    stat = os.stat(filein)
+    return [os.path.basename(filein), stat.st_mtime_ns, stat.st_size]
+
+def binFileMaxCharge(filein, hist_file):
+    # Streams one chunk output and stores its binned maxCharge histogram, tagged with the signature of the file
+    max_charge = np.array([np.amax(pixels) for truth, pixels in iter_events(filein)])
+    contents, stats = bin_values(max_charge, *MAX_CHARGE_BINS)
+    np.savez(hist_file, contents=contents, stats=stats, signature=np.array(file_signature(filein), dtype=str))
+    print(filein, ": number of events = ", len(max_charge))
+
+def incrementalFit(pattern, ncores=1):
+    # Monitoring mode for a production running under job_submit.py: every chunk output is binned once, into
+    # Runs/maxCharge_<name>/<chunk>.npz, and re-binned only if the file changed since. The merged histogram is
+    # the sum of the per-chunk ones; fits are cached by the hash of the chunk set, so a fit only runs when
+    # chunks were added or changed
+    files = expand_files(pattern)
+    cache_dir = os.path.join("Runs", "maxCharge_"+outname)
+    os.makedirs(cache_dir, exist_ok=True)
+    hist_files = [os.path.join(cache_dir, os.path.basename(filein)+".npz") for filein in files]
+    stale = []
+    for filein, hist_file in zip(files, hist_files):
+        if os.path.exists(hist_file):
+            with np.load(hist_file) as cached:
+                if cached['signature'].tolist() == [str(value) for value in file_signature(filein)]:
+                    continue
+        stale.append((filein, hist_file))
+    print("Chunks: ", len(files), ", (re)binned: ", len(stale))
+    if len(stale) > 1:
+        with Pool(min(ncores, len(stale))) as pool:
+            pool.starmap(binFileMaxCharge, stale)
+    elif stale:
+        binFileMaxCharge(*stale[0])
+
+    chunk_set = hashlib.sha1(json.dumps([file_signature(filein) for filein in files]).encode()).hexdigest()
+    fits_file = os.path.join(cache_dir, "fits.json")
+    fits = {}
+    if os.path.exists(fits_file):
+        with open(fits_file) as f:
+            fits = json.load(f)
+    if chunk_set in fits:
+        print("No new chunks, cached fit: MPV = ", fits[chunk_set]['mpv'])
+        return fits[chunk_set]
+
+    binned = None
+    for hist_file in hist_files:
+        with np.load(hist_file) as cached:
+            binned = (cached['contents'], cached['stats']) if binned is None else add_binned(binned, (cached['contents'], cached['stats']))
+    result = fit_max_charge(binned)
+    result['chunks'] = len(files)
+    fits[chunk_set] = result
+    with open(fits_file+".tmp", 'w') as f:
+        json.dump(fits, f, indent=1)
+    os.replace(fits_file+".tmp", fits_file)
+    return result
+
+def main():
+        
+    if options.incremental:
+        incrementalFit(pattern="Runs/"+filename+".out", ncores=options.cores)
+        return
+
+    i = int(sys.argv[1])
+    tag = "d"+str(i)
+    arr_max_charge, arr_truth = parseFiles(pattern="Runs/"+filename+".out",tag=tag,ncores=options.cores)
+
+    # first_event = arr_events[3] # 2, 3, 6
+
+    # plt.imshow(first_event, cmap='Reds', interpolation='nearest')
+    # plt.colorbar()
+    # plt.show()
+
+    print("The number of events: ", arr_max_charge.shape[0])
+    print("The max value in the array is: ", np.amax(arr_max_charge))
+    print("The shape of the truth array: ", arr_truth.shape)
 
-    #df2 is a df with the reconstructed clusters
-    df2 = pd.DataFrame(arranged_events)
-    df2.to_csv("recon_"+filename+".csv", index = False)
+    fit_max_charge(bin_values(arr_max_charge, *MAX_CHARGE_BINS))
 
 if __name__ == "__main__":
     main()
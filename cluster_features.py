@@ -0,0 +1,43 @@
+# Description: Batched cluster features for PixelAV events, computed with reductions over an (N, rows, cols) tensor
+
+import numpy as np
+
+BLOCK_SIZE = 10000 # Events processed at a time, bounds the temporary arrays
+
+FEATURES = ['sumCharge', 'xSpan', 'ySpan', 'Area', 'maxCharge', 'secondMaxCharge', 'theta']
+
+def first_true(mask):
+    return np.argmax(mask, axis=1)
+
+def last_true(mask):
+    return mask.shape[1] - 1 - np.argmax(mask[:, ::-1], axis=1)
+
+def find_theta(cluster_truth):
+    # Angle of the track direction (n_x, n_y, n_z) w.r.t. the Z-axis, same convention as find_angle
+    direction = np.asarray(cluster_truth, dtype=np.float64)[:, 3:6]
+    cos_theta = direction[:, 2] / np.linalg.norm(direction, axis=1)
+    return 180 - np.degrees(np.arccos(cos_theta))
+
+def cluster_features(events, cluster_truth, threshold, block_size=BLOCK_SIZE):
+    # events can be any array-like of shape (N, rows, cols), e.g. a memory-mapped cluster store chunk;
+    # only block_size events are loaded at a time. Spans are 0 for events without pixels above threshold
+    nevents = len(events)
+    features = {name: np.zeros(nevents) for name in FEATURES}
+    for name in ('xSpan', 'ySpan', 'Area'):
+        features[name] = np.zeros(nevents, dtype=np.int64)
+    for start in range(0, nevents, block_size):
+        stop = min(start + block_size, nevents)
+        block = np.asarray(events[start:stop])
+        above = block > threshold
+        rows_hit = above.any(axis=2)
+        cols_hit = above.any(axis=1)
+        hit = rows_hit.any(axis=1)
+        features['sumCharge'][start:stop] = block.sum(axis=(1, 2), dtype=np.float64)
+        features['xSpan'][start:stop] = np.where(hit, last_true(rows_hit) - first_true(rows_hit) + 1, 0)
+        features['ySpan'][start:stop] = np.where(hit, last_true(cols_hit) - first_true(cols_hit) + 1, 0)
+        features['Area'][start:stop] = above.sum(axis=(1, 2))
+        top2 = np.partition(block.reshape(len(block), -1), -2, axis=1)[:, -2:]
+        features['maxCharge'][start:stop] = top2[:, 1]
+        features['secondMaxCharge'][start:stop] = top2[:, 0]
+    features['theta'] = find_theta(cluster_truth) if nevents else np.zeros(0)
+    return features
@@ -0,0 +1,104 @@
+# Description: Chunked binary store of PixelAV clusters, a directory of .npy chunks that can be memory-mapped:
+#              events_<i>.npy (float32, [event, pixel row, pixel column]) and truth_<i>.npy (float64, [event, 9])
+
+import os
+import glob
+import optparse
+import numpy as np
+from pixelav_reader import iter_events
+from job_submit import CHUNK_SIZE as CHUNK_EVENTS # Events per chunk, as in the PixelAV jobs
+TRUTH_COLUMNS = ['x-entry', 'y-entry', 'z-entry', 'n_x', 'n_y', 'n_z', 'number_eh_pairs', 'y-local', 'pt']
+
+def chunk_files(store_dir, kind='events'):
+    return sorted(glob.glob(os.path.join(store_dir, kind+'_*.npy')))
+
+def chunk_file_name(store_dir, kind, index):
+    return os.path.join(store_dir, f'{kind}_{index:05d}.npy')
+
+def lock_file_name(store_dir, index):
+    return os.path.join(store_dir, f'chunk_{index:05d}.lock')
+
+def clear_store(store_dir):
+    for kind in ('events', 'truth'):
+        for name in chunk_files(store_dir, kind):
+            os.remove(name)
+    for name in glob.glob(os.path.join(store_dir, 'chunk_*.lock')):
+        os.remove(name)
+
+def reserve_index(store_dir):
+    # First free chunk index after the existing chunks, claimed by creating its lock file exclusively:
+    # appenders running at the same time (e.g. as job_submit.py chunks finish) never get the same index
+    index = len(chunk_files(store_dir))
+    while True:
+        if not os.path.exists(chunk_file_name(store_dir, 'events', index)):
+            try:
+                os.close(os.open(lock_file_name(store_dir, index), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return index
+            except FileExistsError:
+                pass
+        index += 1
+
+def append_chunk(store_dir, events, truth):
+    # Adds one chunk after the existing ones; files are renamed into place once complete, so that readers
+    # never see a partially written chunk
+    os.makedirs(store_dir, exist_ok=True)
+    index = reserve_index(store_dir)
+    for kind, arr, dtype in (('truth', truth, np.float64), ('events', events, np.float32)):
+        name = chunk_file_name(store_dir, kind, index)
+        with open(name+'.tmp', 'wb') as f:
+            np.save(f, np.asarray(arr, dtype=dtype))
+        os.replace(name+'.tmp', name)
+    os.remove(lock_file_name(store_dir, index))
+    return index
+
+def absorb_store(store_dir, part_dir):
+    # Moves the chunks of part_dir (e.g. written by a worker process) after the existing chunks of store_dir
+    for events_file, truth_file in zip(chunk_files(part_dir, 'events'), chunk_files(part_dir, 'truth')):
+        index = reserve_index(store_dir)
+        os.replace(truth_file, chunk_file_name(store_dir, 'truth', index))
+        os.replace(events_file, chunk_file_name(store_dir, 'events', index))
+        os.remove(lock_file_name(store_dir, index))
+    if os.path.isdir(part_dir):
+        os.rmdir(part_dir)
+
+def convert_out_file(filein, store_dir, chunk_events=CHUNK_EVENTS, nevents=-1):
+    # Streams a PixelAV .out file into the store, appending one chunk per chunk_events events
+    events = None
+    truth = np.empty((chunk_events, len(TRUTH_COLUMNS)))
+    nfilled = 0
+    nchunks = 0
+    for cluster_truth, pixels in iter_events(filein, nevents=nevents):
+        if events is None:
+            events = np.empty((chunk_events,) + pixels.shape, dtype=np.float32)
+        events[nfilled] = pixels
+        truth[nfilled] = cluster_truth
+        nfilled += 1
+        if nfilled == chunk_events:
+            append_chunk(store_dir, events, truth)
+            nchunks += 1
+            nfilled = 0
+    if nfilled:
+        append_chunk(store_dir, events[:nfilled], truth[:nfilled])
+        nchunks += 1
+    return nchunks
+
+def iter_chunks(store_dir, mmap=True):
+    # Yields (events, truth) per chunk, in the order they were appended
+    for events_file, truth_file in zip(chunk_files(store_dir, 'events'), chunk_files(store_dir, 'truth')):
+        yield np.load(events_file, mmap_mode='r' if mmap else None), np.load(truth_file)
+
+def load_truth(store_dir):
+    return np.concatenate([np.load(name) for name in chunk_files(store_dir, 'truth')])
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser("usage: %prog [options]\n")
+    parser.add_option('-i', '--input', dest='input', help="PixelAV .out file")
+    parser.add_option('-o', '--output', dest='output', help="Store directory")
+    parser.add_option('-n', '--chunk', dest='chunk', type='int', default=CHUNK_EVENTS, help="Events per chunk")
+    parser.add_option('-a', '--append', action='store_true', dest='append', help="Append to an existing store instead of replacing it")
+    options, args = parser.parse_args()
+
+    if not options.append:
+        clear_store(options.output)
+    nchunks = convert_out_file(options.input, options.output, options.chunk)
+    print("Appended %d chunk(s) to %s" % (nchunks, options.output))
@@ -0,0 +1,193 @@
+# Description: DF-ISE text reader and writer for grids (_msh.grd) and datasets (_des.dat).
+#              The reader streams the Info block and the Vertices / Values sections into NumPy arrays and mirrors
+#              the result in <file>.npz, reused as long as the SHA-1 of the file is unchanged. Datasets are kept
+#              per region (validity), as Sentaurus repeats a dataset once per region.
+#              The writer takes in-memory arrays; the header (Info block and the opening of the Vertices / Values
+#              section) is given by the caller, with the vertex count already filled in
+
+import os
+import re
+import json
+import hashlib
+import numpy as np
+
+VALUES_PER_LINE = 10 # Values per line of a dataset body
+BLOCK_LINES = 100000 # Lines formatted (or parsed) at a time
+HASH_BLOCK = 1 << 20 # Bytes hashed at a time
+CACHE_VERSION = 2 # Layout of the .npz mirror, older mirrors are parsed again
+
+SECTION = re.compile(r'^\s*(Vertices|Values)\s*\(\s*(\d+)\s*\)\s*\{(.*)$')
+DATASET = re.compile(r'^\s*Dataset\s*\(\s*"([^"]*)"\s*\)\s*\{')
+ASSIGNMENT = re.compile(r'^\s*(\w+)\s*=\s*(.*?)\s*$')
+
+def is_dfise(filename):
+    with open(filename, 'r', errors='replace') as f:
+        return f.readline().startswith('DF-ISE')
+
+def parse_value(text):
+    # Info / Dataset attribute: number, name, quoted string or [ list ]
+    if text.startswith('['):
+        return [parse_value(item) for item in re.findall(r'"[^"]*"|[^\s\]\[]+', text)]
+    if text.startswith('"'):
+        return text.strip('"')
+    for convert in (int, float):
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+    return text
+
+def read_section(f, count, rest):
+    # Reads the count floats of a Vertices / Values section, BLOCK_LINES lines at a time, into a preallocated array
+    values = np.empty(count)
+    nfilled = 0
+    lines = [rest]
+    done = False
+    while not done:
+        line = f.readline()
+        if not line:
+            raise ValueError("Unterminated DF-ISE section")
+        if '}' in line:
+            line = line[:line.index('}')]
+            done = True
+        lines.append(line)
+        if done or len(lines) >= BLOCK_LINES:
+            block = np.fromstring(' '.join(lines), dtype=np.float64, sep=' ')
+            if nfilled + len(block) > count:
+                raise ValueError("DF-ISE section holds more than the %d declared values" % count)
+            values[nfilled:nfilled+len(block)] = block
+            nfilled += len(block)
+            lines = []
+    if nfilled != count:
+        raise ValueError("DF-ISE section holds %d values instead of %d" % (nfilled, count))
+    return values
+
+def parse_dfise(filename):
+    # Returns {'info': {...}, 'vertices': [nb_vertices, dimension] (grids),
+    #          'datasets': [{'name': name, 'attributes': {...}, 'values': [n, dimension]}, ...] (datasets, in file order,
+    #                      one entry per region: the same name can appear several times with different validity)}
+    result = {'info': {}, 'datasets': []}
+    block = None
+    dataset = None
+    with open(filename, 'r') as f:
+        for line in f:
+            stripped = line.strip()
+            if stripped.startswith('Info'):
+                block = result['info']
+            elif DATASET.match(line):
+                dataset = {'name': DATASET.match(line).group(1), 'attributes': {}}
+                block = dataset['attributes']
+                result['datasets'].append(dataset)
+            elif SECTION.match(line):
+                kind, count, rest = SECTION.match(line).groups()
+                if kind == 'Vertices':
+                    # Vertices (n) counts vertices, Values (n) counts values
+                    dimension = result['info'].get('dimension', 3)
+                    result['vertices'] = read_section(f, int(count)*dimension, rest).reshape(-1, dimension)
+                else:
+                    values = read_section(f, int(count), rest)
+                    dimension = dataset['attributes'].get('dimension', 1)
+                    dataset['values'] = values.reshape(-1, dimension) if dimension > 1 else values
+                block = None
+            elif stripped == '}':
+                block = None
+            elif block is not None and ASSIGNMENT.match(line):
+                key, value = ASSIGNMENT.match(line).groups()
+                block[key] = parse_value(value)
+    return result
+
+def file_hash(filename):
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_BLOCK), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def cache_file_name(filename):
+    return filename + '.npz'
+
+def read_dfise(filename):
+    # parse_dfise, with the arrays mirrored in <filename>.npz together with the SHA-1 of the file
+    digest = file_hash(filename)
+    cache_file = cache_file_name(filename)
+    if os.path.exists(cache_file):
+        with np.load(cache_file) as cached:
+            if 'version' in cached and int(cached['version']) == CACHE_VERSION and str(cached['sha1']) == digest:
+                result = json.loads(str(cached['header']))
+                if 'vertices' in cached:
+                    result['vertices'] = cached['vertices']
+                for iter, dataset in enumerate(result['datasets']):
+                    dataset['values'] = cached['values_%d' % iter]
+                return result
+    result = parse_dfise(filename)
+    arrays = {'values_%d' % iter: dataset['values'] for iter, dataset in enumerate(result['datasets'])}
+    if 'vertices' in result:
+        arrays['vertices'] = result['vertices']
+    header = {'info': result['info'], 'datasets': [{'name': dataset['name'], 'attributes': dataset['attributes']} for dataset in result['datasets']]}
+    try:
+        with open(cache_file + '.tmp', 'wb') as f:
+            np.savez(f, version=CACHE_VERSION, sha1=digest, header=json.dumps(header), **arrays)
+        os.replace(cache_file + '.tmp', cache_file)
+    except OSError:
+        print("Could not cache ", filename, " in ", cache_file)
+    return result
+
+def read_vertices(filename):
+    return read_dfise(filename)['vertices']
+
+def read_values(filename, dataset=None, region=None):
+    # Values of the named dataset (the first one by default), restricted to the datasets valid in region if given.
+    # The values are returned only if they are given on every vertex (one dataset covering the whole grid), so that
+    # they can be indexed with the vertex indices of the grid
+    result = read_dfise(filename)
+    if not result['datasets']:
+        raise ValueError("No dataset in " + filename)
+    name = dataset if dataset is not None else result['datasets'][0]['name']
+    selected = [entry for entry in result['datasets'] if entry['name'] == name
+                and (region is None or region in entry['attributes'].get('validity', []))]
+    if not selected:
+        raise ValueError("No dataset %s%s in %s" % (name, "" if region is None else " valid in " + region, filename))
+    if len(selected) > 1:
+        raise ValueError("Dataset %s of %s is given per region (%s), choose one" % (name, filename,
+                         ", ".join(str(entry['attributes'].get('validity')) for entry in selected)))
+    values = selected[0]['values']
+    nb_vertices = result['info'].get('nb_vertices')
+    dimension = selected[0]['attributes'].get('dimension', 1)
+    if nb_vertices is not None and values.size != nb_vertices*dimension:
+        raise ValueError("Dataset %s of %s holds %d values for %d vertices of dimension %d" % (name, filename, values.size, nb_vertices, dimension))
+    return values
+
+def write_grid(filename, header, coords):
+    # One vertex per line, coordinates in their shortest round-trip representation
+    coords = np.asarray(coords, dtype=np.float64)
+    with open(filename, 'w') as output_file:
+        output_file.write(header)
+        output_file.write('\n')
+        for start in range(0, len(coords), BLOCK_LINES):
+            output_file.write(''.join(' ' + ' '.join(map(repr, row)) + '\n' for row in coords[start:start+BLOCK_LINES].tolist()))
+        output_file.write('\n  }\n}\n')
+
+def format_values(values):
+    # values (a list) in lines of VALUES_PER_LINE, lines separated by '\n ', formatted with a single % operation
+    nfull, rest = divmod(len(values), VALUES_PER_LINE)
+    line_formats = [' '.join(['%.6e']*VALUES_PER_LINE)]*nfull
+    if rest:
+        line_formats.append(' '.join(['%.6e']*rest))
+    return '\n '.join(line_formats) % tuple(values)
+
+def write_dataset(filename, header, values):
+    # values: one value (scalar) or one row of components (vector) per vertex, written flattened;
+    # zeros are written as 0.000000e+00, also when negative
+    values = np.asarray(values, dtype=np.float64).ravel() + 0.0
+    with open(filename, 'w') as output_file:
+        output_file.write(header)
+        output_file.write('\n ')
+        # Blocks hold whole lines, only the last one can end with a partial line
+        block = BLOCK_LINES*VALUES_PER_LINE
+        for start in range(0, len(values), block):
+            block_values = values[start:start+block].tolist()
+            output_file.write(format_values(block_values))
+            # The line break after a full line is written before the next value
+            if len(block_values) % VALUES_PER_LINE == 0:
+                output_file.write('\n ')
+        output_file.write('\n    }\n  }\n\n}\n')
@@ -2,12 +2,15 @@ import argparse
 import sys
 import os.path
 import re
+import numpy as np
 
 # argument parser
 def argumentParser(arguments):
   parser = argparse.ArgumentParser()
   parser.add_argument("--prefix",help="2D map name prefix",required=True)
-  parser.add_argument("--suffix",help="2D map name suffix",required=True)
+  suffix = parser.add_mutually_exclusive_group(required=True)
+  suffix.add_argument("--suffix",help="2D map name suffix")
+  suffix.add_argument("--suffixes",nargs="+",help="2D map name suffixes, one per observable (e.g. _EFieldX.dat _EFieldY.dat _EFieldZ.dat): the slices of all of them are stacked into one merged 3D map, as merge_maps.py does")
   parser.add_argument("--outputname",help="3D map output file name",required=True)
   parser.add_argument("--zmin",help="zmin",type=float,required=True)
   parser.add_argument("--zmax",help="zmax",type=float,required=True)
@@ -18,6 +21,13 @@ def argumentParser(arguments):
 
   return args
 
+def read_slice(file_name):
+  # all columns of a 2D map at once: [npoints, ncolumns]
+  with open(file_name,'r') as fin:
+    text = fin.read()
+  ncolumns = len(text.split('\n',1)[0].split())
+  return np.fromstring(text, dtype=np.float64, sep=' ').reshape(-1, ncolumns)
+
 
 if (__name__ == "__main__" ):
   args = argumentParser(sys.argv[1:])
@@ -26,8 +36,8 @@ if (__name__ == "__main__" ):
 
   # prefix of the 2D map
   prefix = args.prefix
-  # suffix of the 2D map
-  suffix = args.suffix
+  # suffix(es) of the 2D map
+  suffixes = args.suffixes if args.suffixes else [args.suffix]
   # 3D map output filename
   outputname = args.outputname
   zmin = args.zmin
@@ -45,26 +55,23 @@ if (__name__ == "__main__" ):
       z = round(tmpz/100,2)
       if(tmpz>tmpzmax):
         z = round(tmpzmax/100,2)
-      # the name of the 2D map file for the actual z value
-      Slice2D = prefix + str(iter) + suffix
-      #print(Slice2D)
-      if os.path.exists(Slice2D):
-        print(Slice2D + " exists")
-        #after having checked the file exists we read it line by line
-        with open(Slice2D,'r') as fin:
-          finlines = fin.readlines()
-          #print(finlines)
-          # now loop over each line to extrac the x and y coordinates and the observable
-          for finline in finlines:
-            # remove trailing new line
-            finline.rstrip()
-            # split to extract the values
-            buff = finline.split()
-            x = float(buff[0])
-            y = float(buff[1])
-            o = float(buff[2])
-            # write the result in the output file, including the z component
-            fout.write(("%f %f %f %f\n") % (x,y,z,o))
+      # the name of the 2D map files for the actual z value
+      slices = [prefix + str(iter) + suffix for suffix in suffixes]
+      #print(slices)
+      if all(os.path.exists(Slice2D) for Slice2D in slices):
+        print(" ".join(slices) + " exist" if len(slices) > 1 else slices[0] + " exists")
+        # after having checked the files exist we read each of them at once
+        maps = [read_slice(Slice2D) for Slice2D in slices]
+        for Slice2D, map2D in zip(slices[1:], maps[1:]):
+          if len(map2D) != len(maps[0]):
+            print("%s and %s have different number of lines: %d vs %d\nExiting..." % (slices[0], Slice2D, len(maps[0]), len(map2D)))
+            exit(1)
+        # the x and y coordinates, the z component and the observable of every map
+        block = np.column_stack([maps[0][:, 0], maps[0][:, 1], np.full(len(maps[0]), z)] + [map2D[:, 2] for map2D in maps])
+        # write the result in the output file, including the z component
+        np.savetxt(fout, block, fmt="%f")
+      elif any(os.path.exists(Slice2D) for Slice2D in slices):
+        print("Incomplete slice, skipped: " + " ".join(Slice2D for Slice2D in slices if not os.path.exists(Slice2D)) + " missing")
   
   print("3D output map is available here: %s" % (outputname))
 
@@ -9,11 +9,8 @@ source allCuts.txt
 deckbuild -run loop_Ex.in -outfile loop_Ex.out &
 deckbuild -run loop_Ey.in -outfile loop_Ey.out &
 deckbuild -run loop_Ez.in -outfile loop_Ez.out &
-python3 create-3D-map.py --prefix map2Dz_ --suffix _EFieldX.dat --outputname E_FieldX.dat --zmin 0 --zmax 6.25 --step 0.1
-python3 create-3D-map.py --prefix map2Dz_ --suffix _EFieldY.dat --outputname E_FieldY.dat --zmin 0 --zmax 6.25 --step 0.1
-python3 create-3D-map.py --prefix map2Dz_ --suffix _EFieldZ.dat --outputname E_FieldZ.dat --zmin 0 --zmax 6.25 --step 0.1
-# important to pass inputs in this order
-python3 merge_maps.py --output EField_YX.txt --input E_FieldX.dat E_FieldY.dat E_FieldZ.dat
+# stacks the slices of the three components and merges them in one pass (as merge_maps.py); important to pass suffixes in this order
+python3 create-3D-map.py --prefix map2Dz_ --suffixes _EFieldX.dat _EFieldY.dat _EFieldZ.dat --outputname EField_YX.txt --zmin 0 --zmax 6.25 --step 0.1
 
 python3 extract-2D.py --template template_E_Field_X.set --set  cutX_ --TwoDname map2Dx_ --ThreeDname ../cmsPixel_50x13_postBias_-100V.str --zmin 0 --zmax 25 --step 0.5 > allCuts.txt
 source allCuts.txt
@@ -21,11 +18,8 @@ source allCuts.txt
 deckbuild -run loop_Ex.in -outfile loop_Ex.out &
 deckbuild -run loop_Ey.in -outfile loop_Ey.out &
 deckbuild -run loop_Ez.in -outfile loop_Ez.out &
-python3 create-3D-map.py --prefix map2Dx_ --suffix _EFieldX.dat --outputname E_FieldX.dat --zmin 0 --zmax 25 --step 0.5
-python3 create-3D-map.py --prefix map2Dx_ --suffix _EFieldY.dat --outputname E_FieldY.dat --zmin 0 --zmax 25 --step 0.5
-python3 create-3D-map.py --prefix map2Dx_ --suffix _EFieldZ.dat --outputname E_FieldZ.dat --zmin 0 --zmax 25 --step 0.5
-# important to pass inputs in this order
-python3 merge_maps.py --output EField_YZ.txt --input E_FieldX.dat E_FieldY.dat E_FieldZ.dat
+# stacks the slices of the three components and merges them in one pass (as merge_maps.py); important to pass suffixes in this order
+python3 create-3D-map.py --prefix map2Dx_ --suffixes _EFieldX.dat _EFieldY.dat _EFieldZ.dat --outputname EField_YZ.txt --zmin 0 --zmax 25 --step 0.5
 
 # gen final efield & grid files from silvaco data
 # EField_YX.txt and EField_YZ.txt are generated from the prev steps and should be stored in prodname folder
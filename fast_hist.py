@@ -0,0 +1,38 @@
+# Description: Fixed-bin histograms filled with NumPy; ROOT (or matplotlib) only receives the finished bin contents
+
+import numpy as np
+
+def bin_values(values, nbins, xmin, xmax):
+    # Bins values the way TH1::Fill does. Returns (contents, stats):
+    # contents has nbins+2 entries [underflow, bin 1..nbins, overflow] (x == xmax goes to the overflow),
+    # stats = [sumw, sumw2, sumwx, sumwx2] of the in-range entries, as accumulated by TH1::Fill
+    values = np.asarray(values, dtype=np.float64).ravel()
+    values = values[~np.isnan(values)]
+    bins = np.floor((values - xmin) * (nbins / (xmax - xmin)))
+    bins = np.clip(bins, -1, nbins).astype(np.int64) + 1
+    contents = np.bincount(bins, minlength=nbins+2).astype(np.float64)
+    in_range = values[(bins >= 1) & (bins <= nbins)]
+    stats = np.array([len(in_range), len(in_range), np.sum(in_range), np.sum(in_range**2)], dtype=np.float64)
+    return contents, stats
+
+def add_binned(binned1, binned2):
+    # Histograms with the same binning are merged by summing contents and stats
+    return binned1[0] + binned2[0], binned1[1] + binned2[1]
+
+def bin_edges(nbins, xmin, xmax):
+    return np.linspace(xmin, xmax, nbins+1)
+
+def fill_th1(hist, contents, stats):
+    # Hands finished contents (including under/overflow) and statistics to an existing TH1 with the same binning
+    hist.SetContent(np.ascontiguousarray(contents, dtype=np.float64))
+    hist.PutStats(np.ascontiguousarray(stats, dtype=np.float64))
+    hist.SetEntries(float(np.sum(contents)))
+    return hist
+
+def make_th1(name, title, nbins, xmin, xmax, values=None, binned=None):
+    # TH1F filled from values (binned here with NumPy) or from a (contents, stats) pair returned by bin_values
+    import ROOT
+    hist = ROOT.TH1F(name, title, nbins, xmin, xmax)
+    if binned is None:
+        binned = bin_values(values, nbins, xmin, xmax)
+    return fill_th1(hist, *binned)
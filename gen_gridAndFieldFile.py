@@ -2,14 +2,17 @@
 # Description: Combine the grid & E.Field files generated from two perpendicular slices generated using merge_maps.py
 
 import csv
-from scipy.spatial import KDTree
+from scipy.spatial import cKDTree
 import numpy as np
 import matplotlib.pyplot as plt
 import os
 import optparse
+from dfise import write_grid, write_dataset
 
 parser = optparse.OptionParser("usage: %prog [options]\n")
 parser.add_option('-p', '--prodname', dest='prodname', help="The name of sensor production")
+parser.add_option('-d', '--debug', action='store_true', dest='debug', help="Also write the intermediate silvacoCombinedOutput.txt and silvacoMergedOutput.grd/.dat files")
+parser.add_option('-k', '--candidates', dest='candidates', type='int', default=8, help="Candidate partners checked per point when merging the slices [default: %default]")
 options, args = parser.parse_args()
 
 foldername = options.prodname
@@ -76,73 +79,59 @@ def read_coordinates(filename):
                 data.append([float(row[3]), float(row[4]), float(row[5])])
         return (np.array(coord), np.array(data))
 
+def match_points(coords1, coords2, candidates=8):
+    # Partner in coords2 of every point of coords1: the point within the x/y/z tolerance box that is closest in
+    # tolerance units. The search runs in coordinates scaled by 1/tolerance, where the box is the unit
+    # Chebyshev (p=inf) ball, among the k nearest candidates. Returns (matched mask, partner indices)
+    scale = 1/np.array([x_tolerance, y_tolerance, z_tolerance])
+    kdtree = cKDTree(coords2*scale)
+    # Slightly above 1 so that points on the box boundary are not lost to rounding, the box is checked below
+    dist, idx = kdtree.query(coords1*scale, k=candidates, p=np.inf, distance_upper_bound=1 + 1e-9, workers=-1)
+    idx = idx.reshape(len(coords1), -1)
+    found = idx < len(coords2)
+    partners = coords2[np.where(found, idx, 0)]
+    delta = np.abs(coords1[:, np.newaxis, :] - partners)
+    in_box = found & (delta[:, :, 0] <= x_tolerance) & (delta[:, :, 1] <= y_tolerance) & (delta[:, :, 2] <= z_tolerance)
+    score = np.where(in_box, np.sum((delta*scale)**2, axis=2), np.inf)
+    best = np.argmin(score, axis=1)
+    matched = in_box[np.arange(len(coords1)), best]
+    return matched, idx[np.arange(len(coords1)), best]
+
 def compare_coordinates(coords1, coords2, data1, data2):
-    # Build KD-tree from the points
-    kdtree = KDTree(coords2)
-    for index, (x1, y1, z1) in enumerate(coords1):
-        tmp = np.array([x1, y1, z1])
-        # Query the KD-tree for the closest point to the user-defined coordinate
-        dist, idx = kdtree.query(tmp)
-        # Closest point
-        closest_point = coords2[idx]
-        if abs(x1 - closest_point[0]) <= x_tolerance and abs(y1 - closest_point[1]) <= y_tolerance and abs(z1 - closest_point[2]) <= z_tolerance:
-            ex1, ey1, ez1 = data1[index][:]
-            ex2, ey2, ez2 = data2[idx][:]
-            print(f'({x1}, {y1}, {z1}, {data1[index]}, {closest_point[0]}, {closest_point[1]}, {closest_point[2]}, {data2[idx]})')
-
-def merge_data(coords1, coords2, data1, data2):
-    npoints = 0
-    # Defining histograms for data quality monitoring
-    hist_x = []
-    hist_y = []
-    hist_z = []
-    delta_x = []
-    delta_y = []
-    delta_z = []
-    delta_x2 = []
-    delta_y2 = []
-    delta_z2 = []
-    delta_data = []
-    delta_data_X = []
-    delta_data_Y = []
-    delta_data_Z = []
-    # Build KD-tree from the points
-    kdtree = KDTree(coords2)
+    matched, idx = match_points(coords1, coords2)
+    for index in np.flatnonzero(matched):
+        x1, y1, z1 = coords1[index]
+        closest_point = coords2[idx[index]]
+        print(f'({x1}, {y1}, {z1}, {data1[index]}, {closest_point[0]}, {closest_point[1]}, {closest_point[2]}, {data2[idx[index]]})')
+
+def merge_data(coords1, coords2, data1, data2, candidates=8):
+    matched, idx = match_points(coords1, coords2, candidates)
+    print("Matched points: ", np.count_nonzero(matched), ", unmatched: ", np.count_nonzero(~matched), " of ", len(coords1))
+    coords1 = coords1[matched]
+    data1 = data1[matched]
+    data2 = data2[idx[matched]]
+    delta = coords1 - coords2[idx[matched]]
+    # Quantities for data quality monitoring
+    hist_x = coords1[:, 0]
+    hist_y = coords1[:, 1]
+    hist_z = coords1[:, 2]
+    delta_x = delta[:, 0]
+    delta_y = delta[:, 1]
+    delta_z = delta[:, 2]
+    delta_data = data1[:, 1] - data2[:, 1]
+    # Every matched point is within all three tolerances
+    delta_x2, delta_y2, delta_z2 = delta_x, delta_y, delta_z
+    delta_data_X = delta_data_Y = delta_data_Z = delta_data
     # Generate combined dataset in accordance to AllPix2 input format
-    with open(path+'silvacoCombinedOutput.txt', 'w') as combined_file, open(path+'silvacoMergedOutput.grd', 'w') as grd_file, open(path+'silvacoMergedOutput.dat', 'w') as dat_file:
-        for index, (x1, y1, z1) in enumerate(coords1):
-            tmp = np.array([x1, y1, z1])
-            # Query the KD-tree for the closest point to the user-defined coordinate
-            dist, idx = kdtree.query(tmp)
-            # Closest point
-            closest_point = coords2[idx]
-            if (abs(x1 - closest_point[0]) <= x_tolerance) and (abs(y1 - closest_point[1]) <= y_tolerance) and (abs(z1 - closest_point[2]) <= z_tolerance):
-                ex1, ey1, ez1 = data1[index][:]
-                ex2, ey2, ez2 = data2[idx][:]
-                # print(f'({x1}, {y1}, {z1}; {closest_point[0]}, {closest_point[1]}, {closest_point[2]}; {data1[index][1]}, {data2[idx][1]})')
-                hist_x.append(x1)
-                hist_y.append(y1)
-                hist_z.append(z1)
-                delta_x.append(x1 - closest_point[0])
-                delta_y.append(y1 - closest_point[1])
-                delta_z.append(z1 - closest_point[2])
-                delta_data.append(ey1 - ey2)
-                # Write into .txt files (both combined, and .grd+.dat file for Allpix2 input for interpolation)
-                # Swap X and Y coordinates and components to match Morris' coordinate
-                combined_file.write(f"{y1}, {x1}, {z1}, {ey1}, {ex1}, {ez2}\n")
-                npoints += 1
-                grd_file.write(f"{y1} {x1} {z1}\n")
-                dat_file.write(f"{ey1} {ex1} {ez2}\n")
-                # Saving some quantities for data-quality monitoring
-                if((abs(x1 - closest_point[0]) >= 0) and (abs(x1 - closest_point[0]) <= x_tolerance)):
-                    delta_x2.append(x1 - closest_point[0])
-                    delta_data_X.append(ey1 - ey2)
-                if((abs(y1 - closest_point[1]) >= 0) and (abs(y1 - closest_point[1]) <= y_tolerance)):
-                    delta_y2.append(y1 - closest_point[1])
-                    delta_data_Y.append(ey1 - ey2)
-                if((abs(z1 - closest_point[2]) >= 0) and (abs(z1 - closest_point[2]) <= z_tolerance)):
-                    delta_z2.append(z1 - closest_point[2])
-                    delta_data_Z.append(ey1 - ey2)
+    # Write into .txt files (both combined, and .grd+.dat file for Allpix2 input for interpolation)
+    # Swap X and Y coordinates and components to match Morris' coordinate
+    grd = np.column_stack([coords1[:, 1], coords1[:, 0], coords1[:, 2]])
+    dat = np.column_stack([data1[:, 1], data1[:, 0], data2[:, 2]])
+    if options.debug:
+        # fmt='%s' gives the shortest round-trip representation of every value
+        np.savetxt(path+'silvacoCombinedOutput.txt', np.column_stack([grd, dat]), fmt='%s', delimiter=', ')
+        np.savetxt(path+'silvacoMergedOutput.grd', grd, fmt='%s', delimiter=' ')
+        np.savetxt(path+'silvacoMergedOutput.dat', dat, fmt='%s', delimiter=' ')
     # Plotting quantities for data quality monitoring
     plot_hist(delta_x, 'DeltaX', 30)
     plot_hist(delta_y, 'DeltaY', 30, False, True)
@@ -154,14 +143,14 @@ def merge_data(coords1, coords2, data1, data2):
     plot_scatter(delta_x2, delta_data_X, 'DeltaX', 'Ey')
     plot_scatter(delta_y2, delta_data_Y, 'DeltaY', 'Ey')
     plot_scatter(delta_z2, delta_data_Z, 'DeltaZ', 'Ey')
-    return npoints
+    return grd, dat
 
 file1 = path+'EField_YX.txt'
 file2 = path+'EField_YZ.txt'
 (coord1, data1) = read_coordinates(file1)
 (coord2, data2) = read_coordinates(file2)
-npts = merge_data(coord1, coord2, data1, data2)
-npts = int(npts)
+(grd, dat) = merge_data(coord1, coord2, data1, data2, options.candidates)
+npts = len(grd)
 header_ef = f"""DF-ISE text
 
 Info {{
@@ -209,31 +198,6 @@ Data {{
   }}
   Vertices (  {npts}) {{"""
 
-with open(path+'silvacoMergedOutput.grd', 'r') as data_file:
-    data = data_file.readlines()
-
-with open(meshfile, 'w') as output_file:
-    output_file.write(header_msh)
-    output_file.write('\n')
-    for line in data:
-        values = line.split()
-        float_values = [str(float(value)) for value in values]
-        output_file.write(' ' + ' '.join(float_values) + '\n')
-    output_file.write('\n  }\n}\n')
-
-with open(path+'silvacoMergedOutput.dat', 'r') as data_file:
-    data = [value for line in data_file for value in line.split()]
-
-with open(fieldfile, 'w') as output_file:
-    output_file.write(header_ef)
-    output_file.write('\n ')
-    for i, value in enumerate(data, start=1):
-        value = float(value)
-        if value == -0.0:
-            value = 0.0
-        if i % 10 != 1:
-            output_file.write(' ')
-        output_file.write('{:.6e}'.format(value))
-        if i % 10 == 0:
-            output_file.write('\n ')
-    output_file.write('\n    }\n  }\n\n}\n')
\ No newline at end of file
+# The DF-ISE files are written straight from the merged arrays
+write_grid(meshfile, header_msh, grd)
+write_dataset(fieldfile, header_ef, dat)
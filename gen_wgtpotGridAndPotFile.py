@@ -7,9 +7,11 @@ import numpy as np
 import matplotlib.pyplot as plt
 import os
 import optparse
+from dfise import write_grid, write_dataset
 
 parser = optparse.OptionParser("usage: %prog [options]\n")
 parser.add_option('-p', '--prodname', dest='prodname', help="The name of sensor production")
+parser.add_option('-d', '--debug', action='store_true', dest='debug', help="Also write the intermediate silvacoWgtPotOutput.grd/.dat files")
 options, args = parser.parse_args()
 
 foldername = options.prodname
@@ -81,28 +83,24 @@ def compare_coordinates(coords1, coords2, data1, data2):
             print(f'({x1}, {y1}, {z1}, {data1[index]}, {closest_point[0]}, {closest_point[1]}, {closest_point[2]}, {data2[idx]})')
 
 def merge_data(coords1, data1):
-    npoints = 0
-    # Defining histograms for data quality monitoring
-    hist_x = []
-    hist_y = []
-    hist_z = []
+    # Quantities for data quality monitoring
+    hist_x = coords1[:, 0]
+    hist_y = coords1[:, 1]
+    hist_z = coords1[:, 2]
     # Generate combined dataset in accordance to AllPix2 input format
-    with open(path+'silvacoWgtPotOutput.grd', 'w') as grd_file, open(path+'silvacoWgtPotOutput.dat', 'w') as dat_file:
-        for index, (x1, y1, z1) in enumerate(coords1):
-            pot = data1[index][0]
-            hist_x.append(x1)
-            hist_y.append(y1)
-            hist_z.append(z1)
-            # Write into .txt files (both combined, and .grd+.dat file for Allpix2 input for interpolation)
-            # Swap X and Y coordinates and components to match Morris' coordinate
-            npoints += 1
-            grd_file.write(f"{y1} {x1} {z1}\n")
-            dat_file.write(f"{pot}\n")
+    # Swap X and Y coordinates and components to match Morris' coordinate
+    grd = np.column_stack([coords1[:, 1], coords1[:, 0], coords1[:, 2]])
+    pot = data1[:, 0]
+    if options.debug:
+        # Write into .txt files (.grd+.dat file for Allpix2 input for interpolation)
+        # fmt='%s' gives the shortest round-trip representation of every value
+        np.savetxt(path+'silvacoWgtPotOutput.grd', grd, fmt='%s', delimiter=' ')
+        np.savetxt(path+'silvacoWgtPotOutput.dat', pot, fmt='%s')
     # Plotting quantities for data quality monitoring
     plot_hist(hist_x, 'CoordX', 200)
     plot_hist(hist_y, 'CoordY', 500)
     plot_hist(hist_z, 'CoordZ', 200)
-    return npoints
+    return grd, pot
 
 file1 = path+'Potential_YX.dat'
 (coord1, data1) = read_coordinates(file1)
@@ -110,8 +108,8 @@ file1 = path+'Potential_YX.dat'
 # Print the last five points
 print("Last five points in coord1:", coord1[-5:])
 print("Last five points in data1:", data1[-5:])
-npts = merge_data(coord1, data1)
-npts = int(npts)
+(grd, pot) = merge_data(coord1, data1)
+npts = len(grd)
 header_ef = f"""DF-ISE text
 
 Info {{
@@ -159,31 +157,6 @@ transform = [  1  0  0  0  1  0  0  0  1 ]
  }}
 Vertices (  {npts}) {{"""
 
-with open(path+'silvacoWgtPotOutput.grd', 'r') as data_file:
-    data = data_file.readlines()
-
-with open(meshfile, 'w') as output_file:
-    output_file.write(header_msh)
-    output_file.write('\n')
-    for line in data:
-        values = line.split()
-        float_values = [str(float(value)) for value in values]
-        output_file.write(' ' + ' '.join(float_values) + '\n')
-    output_file.write('\n  }\n}\n')
-
-with open(path+'silvacoWgtPotOutput.dat', 'r') as data_file:
-    data = [float(line.strip()) for line in data_file]
-
-with open(fieldfile, 'w') as output_file:
-    output_file.write(header_ef)
-    output_file.write('\n ')
-    for i, value in enumerate(data, start=1):
-        value = float(value)
-        if value == -0.0:
-            value = 0.0
-        if i % 10 != 1:
-            output_file.write(' ')
-        output_file.write('{:.6e}'.format(value))
-        if i % 10 == 0:
-            output_file.write('\n ')
-    output_file.write('\n    }\n  }\n\n}\n')
\ No newline at end of file
+# The DF-ISE files are written straight from the merged arrays
+write_grid(meshfile, header_msh, grd)
+write_dataset(fieldfile, header_ef, pot)
@@ -1,15 +1,27 @@
 # Acknowledgements: https://github.com/badeaa3/cmspix28-mc-sim/blob/main/launch.py
 # Description: Script to run PixelAV on multiple cores whilest taking care of splitting the track_list accordingly
 
+import os
 import subprocess
 from multiprocessing import Pool
+from track_list_io import export_text
 
 # Constants
 TOTAL_EVENTS = 2000000
 CHUNK_SIZE = 50000
 NUM_CORES = 6  # Or use multiprocessing.cpu_count() to use all available cores
+TRACK_LIST_PREFIX = "track_list_"
+
+# Track list holding the CHUNK_SIZE tracks of a chunk (numbered from 1, as passed to PixelAV)
+def chunk_file_name(chunk_index, ext=".txt"):
+    return f"{TRACK_LIST_PREFIX}{chunk_index+1}{ext}"
 
 def run_task(chunk_index):
+    # track_gen.py writes binary chunks; the text format read by PixelAV is only produced when needed
+    track_file = chunk_file_name(chunk_index)
+    binary_file = chunk_file_name(chunk_index, ".npy")
+    if not os.path.exists(track_file) and os.path.exists(binary_file):
+        export_text(binary_file, track_file)
     command = f"./ppixelav2_list_trkpy_n_2f {chunk_index+1} {CHUNK_SIZE}"
     print(f"Running: {command}")
     subprocess.run(command, shell=True)
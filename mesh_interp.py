@@ -0,0 +1,84 @@
+# Description: Interpolation of values given on the vertices of a scattered (Silvaco or DF-ISE) mesh at arbitrary points.
+#              Search structures are built once per mesh file and cached: KD-trees in memory, Delaunay
+#              triangulations also on disk, next to the mesh file
+
+import os
+import pickle
+import numpy as np
+from scipy.spatial import cKDTree, Delaunay
+from scipy.interpolate import LinearNDInterpolator
+
+METHODS = ['nearest', 'linear', 'idw']
+IDW_NEIGHBOURS = 8 # Mesh vertices used per point by inverse-distance weighting
+IDW_POWER = 2
+
+mesh_trees = {}
+mesh_triangulations = {}
+
+def mesh_tree(file_name, mesh_points):
+    if file_name not in mesh_trees:
+        mesh_trees[file_name] = cKDTree(np.asarray(mesh_points, dtype=float))
+    return mesh_trees[file_name]
+
+def closest_point_indices(tree, points):
+    # Index of the closest mesh vertex for every point, in one query
+    distances, indices = tree.query(np.asarray(points, dtype=float))
+    return indices
+
+def triangulation_file_name(file_name):
+    return file_name + '.delaunay.pkl'
+
+def mesh_triangulation(file_name, mesh_points):
+    # The triangulation is read back from disk unless the mesh file is newer or has a different number of vertices
+    if file_name in mesh_triangulations:
+        return mesh_triangulations[file_name]
+    mesh_points = np.asarray(mesh_points, dtype=float)
+    cache_file = triangulation_file_name(file_name)
+    triangulation = None
+    if os.path.exists(cache_file) and (not os.path.exists(file_name) or os.path.getmtime(cache_file) >= os.path.getmtime(file_name)):
+        with open(cache_file, 'rb') as f:
+            triangulation = pickle.load(f)
+        if triangulation.points.shape != mesh_points.shape:
+            triangulation = None
+    if triangulation is None:
+        print("Triangulating mesh: ", file_name)
+        triangulation = Delaunay(mesh_points)
+        try:
+            with open(cache_file, 'wb') as f:
+                pickle.dump(triangulation, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            print("Could not cache the triangulation in ", cache_file)
+    mesh_triangulations[file_name] = triangulation
+    return triangulation
+
+def interpolate(values, points, file_name, mesh_points, method='nearest', k=IDW_NEIGHBOURS):
+    # values: one value (or vector, e.g. [Ex, Ey, Ez]) per mesh vertex; returns one value per point
+    #   nearest: value of the closest vertex
+    #   linear:  barycentric interpolation in the Delaunay cell containing the point (closest vertex outside the mesh)
+    #   idw:     inverse-distance weighting of the k closest vertices
+    values = np.asarray(values, dtype=float)
+    points = np.asarray(points, dtype=float)
+    tree = mesh_tree(file_name, mesh_points)
+    if method == 'nearest':
+        return values[closest_point_indices(tree, points)]
+    if method == 'linear':
+        result = LinearNDInterpolator(mesh_triangulation(file_name, mesh_points), values)(points)
+        outside = np.isnan(result.reshape(len(points), -1)).any(axis=1)
+        if outside.any():
+            result[outside] = values[closest_point_indices(tree, points[outside])]
+        return result
+    if method == 'idw':
+        distances, indices = tree.query(points, k=min(k, tree.n))
+        distances = distances.reshape(len(points), -1)
+        indices = indices.reshape(len(points), -1)
+        with np.errstate(divide='ignore'):
+            weights = 1/distances**IDW_POWER
+        # Points on a vertex take its value
+        on_vertex = distances[:, 0] == 0
+        weights[on_vertex] = 0
+        weights[on_vertex, 0] = 1
+        weights /= weights.sum(axis=1, keepdims=True)
+        if values.ndim > 1:
+            weights = weights[:, :, np.newaxis]
+        return np.sum(weights*values[indices], axis=1)
+    raise ValueError("Unknown interpolation method: " + method)
@@ -0,0 +1,123 @@
+# Description: Streaming reader for PixelAV .out files: yields one (truth, pixel matrix) record per <cluster> block
+
+import os
+import re
+import glob
+import numpy as np
+
+TIME_SLICE = 4000.0 # Time slice [ps] whose pixel matrix is read
+BUFFER_SIZE = 1 << 20 # Read buffer [bytes]
+
+def expand_files(pattern):
+    # Files matching a glob pattern (e.g. the chunk outputs of job_submit.py), in chunk order:
+    # numbers in the names are compared numerically, so that chunk 10 comes after chunk 9
+    if not glob.has_magic(pattern):
+        return [pattern]
+    return sorted(glob.glob(pattern), key=lambda name: [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)])
+
+def read_header(filein):
+    with open(filein) as f:
+        header = f.readline().strip()
+        pixelstats = f.readline().strip()
+    return header, pixelstats
+
+def parse_block(rows):
+    # Parses all rows of a time-slice block at once into a (rows, columns) float64 matrix
+    return np.fromstring(b' '.join(rows).decode(), sep=' ').reshape(len(rows), -1)
+
+def iter_blocks(f, time_slice=TIME_SLICE):
+    # Low-level scan of an open binary file: yields (byte offset of the <cluster> line, truth line, pixel rows)
+    # Clusters without a block for time_slice are skipped
+    offset = f.tell()
+    cluster_offset = None
+    truth = None
+    rows = []
+    b_getclusterinfo = False
+    b_geteventinfo = False
+    for line in f:
+        line_offset = offset
+        offset += len(line)
+        line = line.strip()
+        if line.startswith(b'<'):
+            b_geteventinfo = False
+            if line.startswith(b'<cluster>'):
+                if rows:
+                    yield cluster_offset, truth, rows
+                cluster_offset = line_offset
+                truth = None
+                rows = []
+                b_getclusterinfo = True
+            elif line.startswith(b'<time slice') and float(line.split()[2]) == time_slice:
+                b_geteventinfo = True
+            continue
+        if b_getclusterinfo:
+            truth = line
+            b_getclusterinfo = False
+        elif b_geteventinfo and line:
+            rows.append(line)
+    if rows:
+        yield cluster_offset, truth, rows
+
+def iter_events(filein, time_slice=TIME_SLICE, nevents=-1):
+    # Yields (truth, pixel_matrix) for every cluster, reading the file lazily
+    # truth: float64 array [x-entry, y-entry, z-entry, n_x, n_y, n_z, number_eh_pairs, y-local, pt]
+    with open(filein, 'rb', buffering=BUFFER_SIZE) as f:
+        # Skip header and pixelstats
+        f.readline()
+        f.readline()
+        for count, (offset, truth, rows) in enumerate(iter_blocks(f, time_slice)):
+            if count == nevents:
+                break
+            yield np.array(truth.split(), dtype=np.float64), parse_block(rows)
+
+def index_file_name(filein):
+    return filein + '.idx.npz'
+
+def build_index(filein, time_slice=TIME_SLICE):
+    # Scans the file once and stores the byte offset and truth of every cluster in a sidecar .idx.npz file
+    offsets = []
+    cluster_truth = []
+    with open(filein, 'rb', buffering=BUFFER_SIZE) as f:
+        f.readline()
+        f.readline()
+        for offset, truth, rows in iter_blocks(f, time_slice):
+            offsets.append(offset)
+            cluster_truth.append(np.array(truth.split(), dtype=np.float64))
+    index = {'offsets': np.array(offsets, dtype=np.int64), 'truth': np.array(cluster_truth).reshape(len(offsets), -1)}
+    np.savez(index_file_name(filein), **index)
+    return index
+
+def load_index(filein, time_slice=TIME_SLICE):
+    # The sidecar index is rebuilt if it is missing or older than the .out file
+    idx_file = index_file_name(filein)
+    if os.path.exists(idx_file) and os.path.getmtime(idx_file) >= os.path.getmtime(filein):
+        with np.load(idx_file) as index:
+            return {'offsets': index['offsets'], 'truth': index['truth']}
+    print("Building index: ", idx_file)
+    return build_index(filein, time_slice)
+
+def select_events(index, cota_range=None, cotb_range=None):
+    # Indices of the events with cotAlpha = n_x/n_z and cotBeta = n_y/n_z inside the given (min, max) ranges
+    truth = index['truth']
+    selected = np.ones(len(truth), dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if cota_range is not None:
+            cota = truth[:, 3]/truth[:, 5]
+            selected &= (cota >= cota_range[0]) & (cota <= cota_range[1])
+        if cotb_range is not None:
+            cotb = truth[:, 4]/truth[:, 5]
+            selected &= (cotb >= cotb_range[0]) & (cotb <= cotb_range[1])
+    return np.flatnonzero(selected)
+
+def iter_indexed_events(filein, indices, index, time_slice=TIME_SLICE):
+    # Yields (truth, pixel_matrix) for the requested events only, seeking straight to each <cluster> block
+    with open(filein, 'rb', buffering=BUFFER_SIZE) as f:
+        for k in indices:
+            f.seek(index['offsets'][k])
+            offset, truth, rows = next(iter_blocks(f, time_slice))
+            yield index['truth'][k], parse_block(rows)
+
+def read_event(filein, k, index=None, time_slice=TIME_SLICE):
+    if index is None:
+        index = load_index(filein, time_slice)
+    return next(iter_indexed_events(filein, [k], index, time_slice))
@@ -7,6 +7,12 @@ from mpl_toolkits.mplot3d import Axes3D
 import random
 import numpy as np
 import math
+import time
+import optparse
+from multiprocessing import Pool
+from job_submit import CHUNK_SIZE, NUM_CORES, chunk_file_name
+from track_list_io import save_track_list
+from track_hist import stream_histograms, print_comparison, rebin
 
 def mm_to_metre(qty):
     return qty/1000
@@ -27,38 +33,45 @@ tolerance = mm_to_metre(0.5) # Tolerance for checking when the particle crosses
 
 
 # Function to generate random particle tracks
-def generate_init_info():
+# With size=None a single initial state of shape (7,) is returned, otherwise an array of shape (size, 7)
+# rng can be a np.random.Generator for reproducible streams, the global np.random state is used by default
+def generate_init_info(size=None, rng=np.random):
     # Generate random X and Z coordinates within the specified range
-    x_coords = np.random.uniform(mm_to_metre(-2),mm_to_metre(2))
-    y_coords = np.random.uniform(mm_to_metre(-2),mm_to_metre(2))
-    z_coords = np.random.uniform(mm_to_metre(10),mm_to_metre(-10))
-    pt = np.random.uniform(0, ptmax)
-    pz = np.random.uniform(-1, 1)
-    phi = np.random.uniform(0, 2*math.pi)
-    charge = 1
-    return np.array([x_coords, y_coords, z_coords, pt, phi, pz, charge])
-
-def sensor_hit_tracks(num_particles):
-    track_list = []
+    x_coords = rng.uniform(mm_to_metre(-2),mm_to_metre(2), size)
+    y_coords = rng.uniform(mm_to_metre(-2),mm_to_metre(2), size)
+    z_coords = rng.uniform(mm_to_metre(-10),mm_to_metre(10), size)
+    pt = rng.uniform(0, ptmax, size)
+    pz = rng.uniform(-1, 1, size)
+    phi = rng.uniform(0, 2*math.pi, size)
+    charge = np.ones_like(pt)
+    return np.array([x_coords, y_coords, z_coords, pt, phi, pz, charge]).T
+
+def sensor_hit_tracks(num_particles, seed=None, min_batch=10000, max_batch=1000000):
+    # Oversampling generator: candidates are drawn in batches sized from the acceptance measured so far
+    rng = np.random.default_rng(seed)
+    # track_list format: cota, cotb, p, flp, localx, localy, pT
+    track_list = np.empty((num_particles, 7))
     counter = 0
-    while (counter <= num_particles):
-        initial_track = generate_init_info()
+    drawn = 0
+    accepted = 0
+    while (counter < num_particles):
+        remaining = num_particles - counter
+        # Acceptance estimate (starts at 100%), with a 10% margin so that one more batch usually fills the quota
+        acceptance = (accepted + 1) / (drawn + 1)
+        batch_size = int(min(max(1.1*remaining/acceptance, min_batch), max_batch))
         # the beginning of track is at or around the beam pipe (2mm along x and y, and 20mm along z)
-        temp = track_propagate(initial_track)
-        if(temp[0]>0):
-            cota = temp[1]
-            cotb = temp[2]
-            p = temp[3]
-            flp = temp[4]
-            local_x = temp[5]
-            local_y = temp[6]
-            pt = temp[7]
-            # track_list format: cota, cotb, p, flp, localx, localy, pT
-            track_list.append(np.array([cota, cotb, p, flp, metre_to_mm(local_x),metre_to_mm(local_y),pt]))# propagate the track
-            counter += 1
-            if(counter%1000==0 and counter!=0):
-                print("Gen status = ", counter)
-    return np.array(track_list)
+        initial_tracks = generate_init_info(batch_size, rng)
+        temp = track_propagate_batch(initial_tracks)
+        temp = temp[temp[:, 0]>0]
+        drawn += batch_size
+        accepted += len(temp)
+        temp = temp[:remaining]
+        track_list[counter:counter+len(temp)] = temp[:, 1:]
+        track_list[counter:counter+len(temp), 4] = metre_to_mm(temp[:, 5])
+        track_list[counter:counter+len(temp), 5] = metre_to_mm(temp[:, 6])
+        counter += len(temp)
+        print(f"Gen status = {counter}, acceptance = {accepted/drawn:.4f}")
+    return track_list
 
 def plot_traj(iter):
     vector = generate_init_info()
@@ -137,6 +150,85 @@ def track_propagate(vector):
                         # return np.array([1, x_fine, y_fine, z_fine, np.sqrt(pt*pt + pz*pz), pt, pz])
         return np.array([0, 0, 0, 0, 0, 0, 0, 0])
 
+def track_propagate_batch(vectors):
+    # Same output as track_propagate, one row per initial state, but the crossing of the helix with the
+    # y = SENSOR_Y plane is solved in closed form instead of stepping along the path length s.
+    # With u(s) = Phi0 + h*s*cos(Lambda)/R the crossing condition is sin(u) = sin(Phi0) + (SENSOR_Y - y0)/R
+    x_init = vectors[:, 0]
+    y_init = vectors[:, 1]
+    z_init = vectors[:, 2]
+    pt = vectors[:, 3]
+    Phi0 = vectors[:, 4]
+    pz = vectors[:, 5]
+    charge = vectors[:, 6]
+    R = pt / (0.3 * B_FIELD)
+    p = np.sqrt(pt**2 + pz**2)
+    Lambda = np.arcsin(pz/p)
+    h = -1#math.copysign(1, charge*B_FIELD)
+    result = np.zeros((len(vectors), 8))
+    # in the best case, if circumference of loop is less than distance to sensor module, then drop event
+    valid = 2*math.pi*R >= mm_to_metre(30)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sin_u = np.sin(Phi0) + (SENSOR_Y - y_init)/R
+        valid &= np.abs(sin_u) <= 1
+        root = np.arcsin(np.clip(sin_u, -1, 1))
+        # Path length scanned by track_propagate: from 20mm up to one circumference (2*pi*R)
+        s_min = mm_to_metre(20)
+        s_max = 2*math.pi*R
+        best_s = np.full(len(vectors), np.inf)
+        # Two solutions per turn: u = asin(.) and u = pi - asin(.); s grows as u decreases since h = -1
+        for u in (root, math.pi - root):
+            s = np.mod(h*(u - Phi0), 2*math.pi)*R/np.cos(Lambda)
+            x = x_init + R*(np.cos(Phi0 + h*s*np.cos(Lambda)/R) - np.cos(Phi0))
+            z = z_init + s*np.sin(Lambda)
+            hit = valid & (s >= s_min) & (s < s_max) & (np.abs(x) < X_MAX) & (np.abs(z) < Z_MAX)
+            best_s = np.where(hit & (s < best_s), s, best_s)
+    hit = np.isfinite(best_s)
+    s = best_s[hit]
+    R, Phi0, Lambda = R[hit], Phi0[hit], Lambda[hit]
+    u = Phi0 + h*s*np.cos(Lambda)/R
+    x_fine = x_init[hit] + R*(np.cos(u) - np.cos(Phi0))
+    y_fine = np.full(len(s), SENSOR_Y)
+    z_fine = z_init[hit] + s*np.sin(Lambda)
+    # Analytic tangent: dx/ds = -h*cos(Lambda)*sin(u), dy/ds = h*cos(Lambda)*cos(u), dz/ds = sin(Lambda)
+    cotPhi = -np.tan(u)
+    cotGamma = np.tan(Lambda)/(h*np.cos(u))
+    # Once s is close to the sensor module, calculate the track list parameters needed by PixelAV
+    x_pav = z_fine
+    z_pav = y_fine
+    y_pav = x_fine
+    result[hit, 0] = 1
+    result[hit, 1] = cotPhi
+    result[hit, 2] = cotGamma
+    result[hit, 3] = p[hit]
+    result[hit, 5] = x_pav
+    result[hit, 6] = y_pav
+    result[hit, 7] = pt[hit]
+    return result
+
+def benchmark_propagate(num_tracks):
+    # Compare the step-scan track_propagate with track_propagate_batch on the same initial states
+    initial_tracks = generate_init_info(num_tracks)
+    start = time.perf_counter()
+    loop_result = np.array([track_propagate(vector) for vector in initial_tracks])
+    loop_time = time.perf_counter() - start
+    start = time.perf_counter()
+    batch_result = track_propagate_batch(initial_tracks)
+    batch_time = time.perf_counter() - start
+    loop_hit = loop_result[:, 0] > 0
+    batch_hit = batch_result[:, 0] > 0
+    both = loop_hit & batch_hit
+    print(f"Step scan: {loop_time:.3f} s, analytic: {batch_time:.3f} s, speed-up = {loop_time/batch_time:.1f}x")
+    print(f"Hits: step scan = {np.sum(loop_hit)}, analytic = {np.sum(batch_hit)}, disagreeing = {np.sum(loop_hit != batch_hit)}")
+    # Differences are expected at the level of the fine-scan step (STEPS/10) and of the module edges
+    names = ['cota', 'cotb', 'p', 'flp', 'localx [mm]', 'localy [mm]', 'pT']
+    for col in (1, 2, 5, 6):
+        delta = batch_result[both, col] - loop_result[both, col]
+        if col in (5, 6):
+            delta = metre_to_mm(delta)
+        print(f"max |delta {names[col-1]}| = {np.max(np.abs(delta), initial=0):.3e}")
+    return loop_result, batch_result
+
 def particle_trajectory(s, x0, y0, z0, R, Phi0, h, Lambda):
     x = x0 + R*(math.cos(Phi0 + h*s*math.cos(Lambda)/R) - math.cos(Phi0))
     y = y0 + R*(math.sin(Phi0 + h*s*math.cos(Lambda)/R) - math.sin(Phi0))
@@ -144,70 +236,96 @@ def particle_trajectory(s, x0, y0, z0, R, Phi0, h, Lambda):
     return (x,y,z)
 
 
-def plot(list1, list2, name, save_name, units):
-    # Find and print the maximum and minimum values in each column
-    print(f'New list: min = {min(list1)}, max = {max(list1)}')
-    print(f'Old list: min = {min(list2)}, max = {max(list2)}')
-    # Create histograms of the values
+def plot(hist1, hist2, name, save_name, units):
+    # Histograms are pre-binned (see track_hist.py) and drawn with their bin contents as weights
     plt.figure(figsize=(10, 4))
     plt.subplot(1, 2, 1)
     if("cotAlpha" in save_name):
-        plt.hist(list1, bins=100, range=(-0.6, 0.6), edgecolor='black')
+        # 100 bins within (-0.6, 0.6)
+        counts, edges = rebin(hist1, 100, window=(-0.6, 0.6))
     else:
-        plt.hist(list1, bins=100, edgecolor='black')
+        counts, edges = rebin(hist1, 100)
+    plt.hist(edges[:-1], bins=edges, weights=counts, edgecolor='black')
     plt.title('Distribution of '+name)
     plt.xlabel('Value ['+units+']')
     plt.ylabel('Frequency')
     plt.subplot(1, 2, 2)
-    plt.hist(list2, bins=50, edgecolor='black')
+    counts, edges = rebin(hist2, 50)
+    plt.hist(edges[:-1], bins=edges, weights=counts, edgecolor='black')
     plt.title('Distribution of '+name)
     plt.xlabel('Value ['+units+']')
     plt.ylabel('Frequency')
     plt.tight_layout()
     plt.savefig('hist'+save_name+'.png')
 
-# Plot sample tracks
-# plot_traj(1)
-# plot_traj(2)
-# plot_traj(3)
-# plot_traj(4)
-# plot_traj(5)
-
-# Generate particle tracks
-# num_particles = 100000  # Adjust the number of particles as needed
-# tracks = sensor_hit_tracks(num_particles)
-
-# # Save the hit positions, momentum, and pT to a file or use them for further analysis
-# print("================")
-# print("Track generation is complete.\nNumber of tracks generated: ", len(tracks))
-# print("================")
-# np.savetxt("new_track_list.txt", tracks, delimiter=' ', header='cota, cotb, p, flp, localx, localy, pT')
-
-# Read the data from the file, skipping lines that start with '#'
-with open('track_list.txt', 'r') as f:
-    lines = [line for line in f if not line.startswith('#')]
-# Read the data from the file, skipping lines that start with '#'
-with open('track_list.txt', 'r') as f2:
-    lines2 = [line for line in f2 if not line.startswith('#')]
-
-values = ['cotAlpha', 'cotBeta', 'P [GeV/c]', 'Local X [mm]', 'Local Y [mm]', 'Pt [GeV/c]']
-save_name = ['cotAlpha', 'cotBeta', 'P_values', 'Local_X_coord', 'Local_Y_coord', 'Pt_values']
-units = ['', '', 'GeV/c', 'mm', 'mm', 'GeV/c']
-qty1, qty2 = [], []
-qty1.append([float(line.split()[0]) for line in lines2]) #cotAlpha
-qty1.append([float(line.split()[1]) for line in lines2]) #cotBeta
-qty1.append([float(line.split()[2]) for line in lines2]) #P
-qty1.append([float(line.split()[4]) for line in lines2]) #Local X
-qty1.append([float(line.split()[5]) for line in lines2]) #Local Y
-qty1.append([float(line.split()[6]) for line in lines2]) #Pt
-
-#cotb cota p flp localx localy pT
-qty2.append([float(line.split()[0]) for line in lines]) #cotAlpha
-qty2.append([float(line.split()[1]) for line in lines]) #cotBeta
-qty2.append([float(line.split()[2]) for line in lines]) #P
-qty2.append([float(line.split()[4]) for line in lines]) #Local X
-qty2.append([float(line.split()[5]) for line in lines]) #Local Y
-qty2.append([abs(float(line.split()[6])) for line in lines]) #Pt
-
-for iter in range(len(values)):
-    plot(qty1[iter], qty2[iter], values[iter], save_name[iter], units[iter])
\ No newline at end of file
+def generate_shard(shard):
+    chunk_index, num_tracks, seed = shard
+    tracks = sensor_hit_tracks(num_tracks, seed=seed)
+    save_track_list(chunk_file_name(chunk_index, ".npy"), tracks)
+    return chunk_index
+
+def generate_shards(num_tracks, seed=None, num_cores=NUM_CORES):
+    # Split the tracks into CHUNK_SIZE shards, one track-list file per PixelAV job in job_submit.py
+    # Every shard gets an independent stream spawned from one SeedSequence, so the output does not
+    # depend on the number of cores or on the order in which shards finish
+    seed_seq = np.random.SeedSequence(seed)
+    print("Seed entropy = ", seed_seq.entropy)
+    num_chunks = -(-num_tracks // CHUNK_SIZE)
+    shard_seeds = seed_seq.spawn(num_chunks)
+    shards = [(i, min(CHUNK_SIZE, num_tracks - i*CHUNK_SIZE), shard_seeds[i]) for i in range(num_chunks)]
+    with Pool(num_cores) as pool:
+        for chunk_index in pool.imap_unordered(generate_shard, shards):
+            print("Written: ", chunk_file_name(chunk_index, ".npy"))
+
+def plot_comparison(new_file, old_file):
+    # Each track list (.npy or text) is read once in chunks, filling the histograms of all columns at once
+    columns = ['cota', 'cotb', 'p', 'localx', 'localy', 'pT']
+    ranges = [(-2, 2), (-2, 2), (0, 5.2), (metre_to_mm(Z_MIN), metre_to_mm(Z_MAX)), (metre_to_mm(X_MIN), metre_to_mm(X_MAX)), (0, ptmax)]
+    values = ['cotAlpha', 'cotBeta', 'P [GeV/c]', 'Local X [mm]', 'Local Y [mm]', 'Pt [GeV/c]']
+    save_name = ['cotAlpha', 'cotBeta', 'P_values', 'Local_X_coord', 'Local_Y_coord', 'Pt_values']
+    units = ['', '', 'GeV/c', 'mm', 'mm', 'GeV/c']
+    hists_new = stream_histograms(new_file, columns, ranges)
+    hists_old = stream_histograms(old_file, columns, ranges, transforms={'pT': np.abs})
+    print_comparison(values, hists_new, hists_old)
+    for iter in range(len(values)):
+        plot(hists_new[iter], hists_old[iter], values[iter], save_name[iter], units[iter])
+
+def main():
+    parser = optparse.OptionParser("usage: %prog [options]\n")
+    parser.add_option('-b', '--benchmark', dest='benchmark', type='int', help="Benchmark the analytic sensor-crossing solver against the step scan on N initial states")
+    parser.add_option('-g', '--generate', dest='generate', type='int', help="Generate N tracks")
+    parser.add_option('-o', '--output', dest='output', default='new_track_list.npy', help="Output track list (ignored with --shards)")
+    parser.add_option('-s', '--seed', dest='seed', type='int', help="Seed for the track generation")
+    parser.add_option('--shards', action='store_true', dest='shards', help="Split the tracks into CHUNK_SIZE files (see job_submit.py) generated in parallel")
+    parser.add_option('-j', '--cores', dest='cores', type='int', default=NUM_CORES, help="Number of processes used with --shards")
+    parser.add_option('-c', '--compare', dest='compare', nargs=2, default=('track_list.txt', 'track_list.txt'), help="New and old track lists (.npy or text) to compare")
+    options, args = parser.parse_args()
+
+    if options.benchmark:
+        benchmark_propagate(options.benchmark)
+        return
+
+    if options.generate and options.shards:
+        generate_shards(options.generate, options.seed, options.cores)
+        return
+
+    if options.generate:
+        tracks = sensor_hit_tracks(options.generate, seed=options.seed)
+        # Save the hit positions, momentum, and pT to a file or use them for further analysis
+        print("================")
+        print("Track generation is complete.\nNumber of tracks generated: ", len(tracks))
+        print("================")
+        save_track_list(options.output, tracks)
+        return
+
+    # Plot sample tracks
+    # plot_traj(1)
+    # plot_traj(2)
+    # plot_traj(3)
+    # plot_traj(4)
+    # plot_traj(5)
+
+    plot_comparison(options.compare[0], options.compare[1])
+
+if __name__ == "__main__":
+    main()
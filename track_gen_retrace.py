@@ -3,9 +3,10 @@
 # Description: Generates tracks for PixelAV. NOTE: very probably that the Physics equations need to be updated.
 
 import matplotlib.pyplot as plt
-import random
 import numpy as np
 import math
+from track_list_io import save_track_list
+from track_hist import stream_histograms, print_comparison, rebin
 
 # Constants
 X_MIN = -8.1  # Minimum X coordinate of sensor array
@@ -16,6 +17,7 @@ SENSOR_Y = 30   # Y coordinate of the sensor array
 ptmax = 5 # in GeV
 m_pion=0.13957 # in GeV/c^2
 B_FIELD = 3.8   # Magnetic field strength in Tesla
+TRACK_COLUMNS = ('X', 'Y', 'Z', 'P', 'Pt') # Columns of the generated track list
 
 # Function to generate random particle tracks
 def generate_hit_info(num_particles):
@@ -26,43 +28,40 @@ def generate_hit_info(num_particles):
     pt = np.random.uniform(0, ptmax, num_particles)
     return np.column_stack((x_coords, y_coords, z_coords, pt))
 
-def generate_full_track(interim_tracks, num_particles):
-    track_list = []
-    for iter in range(len(interim_tracks)):
-        quotient = 21
-        counter = 0
-        while quotient > 20:
-            if counter >= 20:
-                break
-            # the beginning of track can be at or around the beam pipe (2mm along x and y, and 20mm along z)
-            origin_track = (random.uniform(-2,2), random.uniform(-2,2), random.uniform(10,-10))
-            track, quotient = calculate_pz(interim_tracks[iter], origin_track)
-            counter += 1
-        if counter < 20:
-            track_list.append(track)
-    return np.array(track_list)
+def generate_full_track(interim_tracks, num_particles, max_attempts=20, summary=False):
+    # For every hit, up to max_attempts beam-spot origins are drawn at once and the first one giving
+    # fewer than 21 full turns between origin and hit is kept; hits without such an origin are dropped
+    num_hits = len(interim_tracks)
+    # the beginning of track can be at or around the beam pipe (2mm along x and y, and 20mm along z)
+    origin_tracks = np.random.uniform([-2, -2, -10], [2, 2, 10], size=(num_hits, max_attempts, 3))
+    pz, quotient = calculate_pz(interim_tracks, origin_tracks)
+    valid = quotient <= 20
+    first = np.argmax(valid, axis=1)
+    accepted = valid[np.arange(num_hits), first]
+    pz = pz[np.arange(num_hits), first]
+    if summary:
+        attempts = np.bincount(first[accepted] + 1, minlength=max_attempts + 1)[1:]
+        print(f"Accepted {np.sum(accepted)} of {num_hits} hits, mean number of origins tried = {np.sum(attempts*np.arange(1, max_attempts+1))/max(np.sum(accepted), 1):.2f}")
+        print("Accepted hits per attempt: ", attempts)
+    return np.column_stack((interim_tracks[accepted, :3], pz[accepted], interim_tracks[accepted, 3]))
 
-def calculate_pz(interim_track, origin_track):
-    pt = interim_track[3]
+def calculate_pz(interim_tracks, origin_tracks):
+    # interim_tracks: (N, 4) hits [x, y, z, pt], origin_tracks: (N, M, 3) candidate origins per hit
+    # Returns pz and the number of full turns (quotient), both of shape (N, M)
+    pt = interim_tracks[:, None, 3]
     # Ref: http://lppp.lancs.ac.uk/motioninb/en-GB/experiment.html?LPPPSession=1567036800030
     radius = pt / (0.3 * B_FIELD)
-    delta = np.sqrt((interim_track[0] - origin_track[0])**2 + (interim_track[1] - origin_track[1])**2 + (interim_track[2] - origin_track[2])**2)
-    quotient = 21
-    if(2*radius > delta):
-        quotient = 1
+    delta = np.linalg.norm(interim_tracks[:, None, :3] - origin_tracks, axis=2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        quotient, remainder = np.divmod(delta, 2 * radius)
+        # If the hit is within one diameter, remainder == delta and no full turn is added
+        within = 2*radius > delta
+        quotient = np.where(within, 1, quotient)
         # Ref: https://stackoverflow.com/questions/52210911/great-circle-distance-between-two-p-x-y-z-points-on-a-unit-sphere
-        phi = np.arcsin(delta/(2*radius)) 
-        A = 2*radius*phi
-        pz = pt*(interim_track[2] - origin_track[2])/A
-        p = np.sqrt(pt**2 + pz**2)
-    else:
-        quotient, remainder = divmod(delta, 2 * radius)
         phi = np.arcsin(remainder/(2*radius))
         A = 2*radius*phi
-        pz = pt*(interim_track[2] - origin_track[2])/(A+2*math.pi*radius*quotient)
-        p = np.sqrt(pt**2 + pz**2)
-    print(interim_track[0], interim_track[1], interim_track[2], quotient, pz, p)
-    return(interim_track[0], interim_track[1], interim_track[2], pz, pt), quotient
+        pz = pt*(interim_tracks[:, None, 2] - origin_tracks[:, :, 2])/(A + np.where(within, 0, 2*math.pi*radius*quotient))
+    return pz, quotient
 
 # Function to check if particles hit the sensor array and record position, momentum, and pT
 def check_hits(tracks, pt):
@@ -73,19 +72,18 @@ def check_hits(tracks, pt):
     hit_momentum = pt[sensor_hits[:, 1] == SENSOR_Y]
     return hit_positions, hit_momentum
 
-def plot(list1, list2, name, save_name):
-    # Find and print the maximum and minimum values in each column
-    print(f'New list: min = {min(list1)}, max = {max(list1)}')
-    print(f'Old list: min = {min(list2)}, max = {max(list2)}')
-    # Create histograms of the values
+def plot(hist1, hist2, name, save_name):
+    # Histograms are pre-binned (see track_hist.py) and drawn with their bin contents as weights
     plt.figure(figsize=(10, 4))
     plt.subplot(1, 2, 1)
-    plt.hist(list1, bins=100, edgecolor='black')
+    counts, edges = rebin(hist1, 100)
+    plt.hist(edges[:-1], bins=edges, weights=counts, edgecolor='black')
     plt.title('Distribution of '+name)
     plt.xlabel('Value [mm]')
     plt.ylabel('Frequency')
     plt.subplot(1, 2, 2)
-    plt.hist(list2, bins=100, edgecolor='black')
+    counts, edges = rebin(hist2, 100)
+    plt.hist(edges[:-1], bins=edges, weights=counts, edgecolor='black')
     plt.title('Distribution of '+name)
     plt.xlabel('Value [mm]')
     plt.ylabel('Frequency')
@@ -95,35 +93,25 @@ def plot(list1, list2, name, save_name):
 # Generate particle tracks
 num_particles = 100000  # Adjust the number of particles as needed
 interim_tracks = generate_hit_info(num_particles)
-tracks = generate_full_track(interim_tracks, num_particles)
+tracks = generate_full_track(interim_tracks, num_particles, summary=True)
 # Save the hit positions, momentum, and pT to a file or use them for further analysis
 print("================")
 print("Track generation is complete.\nNumber of tracks generated: ", len(tracks))
 print("================")
-np.savetxt("new_track_list.txt", tracks, delimiter=' ', header='X,Y,Z,P,Pt')
-
-# Read the data from the file, skipping lines that start with '#'
-with open('track_list_L1_025GeV.txt', 'r') as f:
-    lines = [line for line in f if not line.startswith('#')]
-# Read the data from the file, skipping lines that start with '#'
-with open('new_track_list.txt', 'r') as f2:
-    lines2 = [line for line in f2 if not line.startswith('#')]
+save_track_list("new_track_list.npy", tracks, TRACK_COLUMNS)
 
+# Old list in the PixelAV text format, new list in the binary format; each is read once in chunks
 values = ['X [mm]', 'Y [mm]', 'Z [mm]', 'P [GeV/c]', 'Pt [GeV/c]']
 save_name = ['X_coord', 'Y_coord', 'Z_coord', 'P_values', 'Pt_values']
-qty1, qty2 = [], []
-qty1.append([float(line.split()[0]) for line in lines2]) #X1
-qty1.append([float(line.split()[1]) for line in lines2]) #Y1
-qty1.append([float(line.split()[2]) for line in lines2]) #Z1
-qty1.append([float(line.split()[3]) for line in lines2]) #P1
-qty1.append([float(line.split()[4]) for line in lines2]) #Pt1
-
+# P is the signed pz of the new list, hence the symmetric range (shared with the old list so that the KS statistic compares the same bins)
+ranges = [(X_MIN, X_MAX), (SENSOR_Y-1, SENSOR_Y+1), (Z_MIN, Z_MAX), (-10, 10), (0, ptmax)]
+hists_new = stream_histograms('new_track_list.npy', ['X', 'Y', 'Z', 'P', 'Pt'], ranges)
 #cotb cota p flp localx localy pT
-qty2.append([float(line.split()[5]) for line in lines]) #X2 (Y in pixelAV coordinates is X in global coordinates)
-qty2.append([float(line.split()[1]) for line in lines2]) #Y2
-qty2.append([float(line.split()[4]) for line in lines]) #Z2 (X in pixelAV coordinates is Z in global coordinates)
-qty2.append([float(line.split()[2]) for line in lines]) #P2
-qty2.append([float(line.split()[6]) for line in lines]) #Pt2
+# Y in pixelAV coordinates is X in global coordinates, X in pixelAV coordinates is Z in global coordinates
+hists_old = stream_histograms('track_list_L1_025GeV.txt', ['localy', 'localx', 'p', 'pT'], ranges[:1]+ranges[2:])
+# The old list has no Y column (all hits are on the sensor plane), the new Y distribution is shown twice
+hists_old.insert(1, hists_new[1])
+print_comparison(values, hists_new, hists_old)
 
 for iter in range(len(values)):
-    plot(qty1[iter], qty2[iter], values[iter], save_name[iter])
+    plot(hists_new[iter], hists_old[iter], values[iter], save_name[iter])
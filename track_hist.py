@@ -0,0 +1,84 @@
+# Description: Single-pass, constant-memory histograms and summary statistics for comparing track lists
+
+import numpy as np
+from itertools import islice
+from track_list_io import TRACK_COLUMNS, text_column_names
+
+FINE_BINS = 4000 # Fine binning of every column; the KS statistic uses it and plots rebin it
+CHUNK_SIZE = 1000000 # Number of tracks read at a time
+
+def iter_track_chunks(filename, columns, chunk_size=CHUNK_SIZE):
+    # Yields (n, len(columns)) arrays of the requested columns, chunk_size tracks at a time
+    if filename.endswith('.npy'):
+        tracks = np.load(filename, mmap_mode='r')
+        for start in range(0, len(tracks), chunk_size):
+            block = tracks[start:start+chunk_size]
+            yield np.column_stack([block[name] for name in columns])
+        return
+    with open(filename, 'r') as f:
+        lines = (line for line in f if not line.startswith('#'))
+        indices = None
+        while True:
+            block = list(islice(lines, chunk_size))
+            if not block:
+                break
+            data = np.loadtxt(block, ndmin=2)
+            if indices is None:
+                names = text_column_names(filename, data.shape[1], TRACK_COLUMNS)
+                indices = [names.index(name) for name in columns]
+            yield data[:, indices]
+
+def new_column_hist(lo, hi, bins=FINE_BINS):
+    return {'edges': np.linspace(lo, hi, bins+1), 'counts': np.zeros(bins, dtype=np.int64),
+            'underflow': 0, 'overflow': 0, 'n': 0, 'sum': 0.0, 'min': np.inf, 'max': -np.inf}
+
+def fill_column_hist(hist, values):
+    counts, _ = np.histogram(values, bins=hist['edges'])
+    hist['counts'] += counts
+    hist['underflow'] += int(np.sum(values < hist['edges'][0]))
+    hist['overflow'] += int(np.sum(values > hist['edges'][-1]))
+    if len(values):
+        hist['n'] += len(values)
+        hist['sum'] += float(np.sum(values))
+        hist['min'] = min(hist['min'], float(np.min(values)))
+        hist['max'] = max(hist['max'], float(np.max(values)))
+
+def stream_histograms(filename, columns, ranges, transforms=None, chunk_size=CHUNK_SIZE):
+    # Reads the file once and fills one fixed-bin histogram per column
+    # transforms maps a column name to a function applied to its values before filling (e.g. np.abs)
+    transforms = transforms or {}
+    hists = [new_column_hist(lo, hi) for lo, hi in ranges]
+    for block in iter_track_chunks(filename, columns, chunk_size):
+        for i, name in enumerate(columns):
+            values = block[:, i]
+            if name in transforms:
+                values = transforms[name](values)
+            fill_column_hist(hists[i], values)
+    return hists
+
+def rebin(hist, nbins, window=None):
+    # nbins has to divide the number of fine bins (of those within window=(lo, hi), if given; lo and hi are fine-bin edges)
+    counts, edges = hist['counts'], hist['edges']
+    if window is not None:
+        first, last = [int(np.argmin(np.abs(edges - edge))) for edge in window]
+        counts, edges = counts[first:last], edges[first:last+1]
+    factor = len(counts) // nbins
+    return counts.reshape(nbins, factor).sum(axis=1), edges[::factor]
+
+def ks_statistic(hist1, hist2):
+    # Two-sample Kolmogorov-Smirnov distance from the binned CDFs (resolution of one fine bin)
+    counts1 = np.concatenate(([hist1['underflow']], hist1['counts'], [hist1['overflow']]))
+    counts2 = np.concatenate(([hist2['underflow']], hist2['counts'], [hist2['overflow']]))
+    cdf1 = np.cumsum(counts1) / max(hist1['n'], 1)
+    cdf2 = np.cumsum(counts2) / max(hist2['n'], 1)
+    return float(np.max(np.abs(cdf1 - cdf2)))
+
+def print_comparison(names, hists1, hists2):
+    ks = []
+    for name, hist1, hist2 in zip(names, hists1, hists2):
+        ks.append(ks_statistic(hist1, hist2))
+        print(f'{name}: KS statistic = {ks[-1]:.4f}')
+        for label, hist in (('New list', hist1), ('Old list', hist2)):
+            print(f'  {label}: n = {hist["n"]}, min = {hist["min"]}, max = {hist["max"]}, mean = {hist["sum"]/max(hist["n"], 1)}, '
+                  f'out of range = {hist["underflow"]}/{hist["overflow"]}')
+    return ks
@@ -0,0 +1,66 @@
+# Description: Binary (.npy) track lists with named columns, and conversion to/from the PixelAV text format
+
+import numpy as np
+import optparse
+
+# track_list format: cota, cotb, p, flp, localx, localy, pT
+TRACK_COLUMNS = ('cota', 'cotb', 'p', 'flp', 'localx', 'localy', 'pT')
+
+def to_structured(tracks, columns=TRACK_COLUMNS):
+    # One float64 field per column, so that columns can be loaded by name
+    tracks = np.asarray(tracks, dtype=np.float64).reshape(-1, len(columns))
+    arr = np.empty(len(tracks), dtype=[(name, np.float64) for name in columns])
+    for i, name in enumerate(columns):
+        arr[name] = tracks[:, i]
+    return arr
+
+def save_track_list(filename, tracks, columns=TRACK_COLUMNS):
+    # The column names are stored in the .npy header together with the dtype and the number of tracks
+    np.save(filename, to_structured(tracks, columns))
+
+def read_text_header(filename):
+    with open(filename, 'r') as f:
+        line = f.readline()
+    if not line.startswith('#'):
+        return None
+    return [name.strip() for name in line[1:].split(',') if name.strip()]
+
+def text_column_names(filename, ncols, columns=TRACK_COLUMNS):
+    # Text track lists (np.savetxt or PixelAV format): column names are taken from the '#' header if present
+    names = read_text_header(filename)
+    if names is None or len(names) != ncols:
+        names = columns if len(columns) == ncols else ['col'+str(i) for i in range(ncols)]
+    return list(names)
+
+def load_track_list(filename, columns=TRACK_COLUMNS, mmap=True):
+    # .npy track lists are memory-mapped, so only the columns that are used get read from disk
+    if filename.endswith('.npy'):
+        return np.load(filename, mmap_mode='r' if mmap else None)
+    data = np.loadtxt(filename, comments='#', ndmin=2)
+    return to_structured(data, text_column_names(filename, data.shape[1], columns))
+
+def export_text(binary_file, text_file, chunk_size=1000000):
+    # Write the PixelAV text format (as np.savetxt in track_gen.py did) from a binary track list
+    tracks = load_track_list(binary_file)
+    names = tracks.dtype.names
+    with open(text_file, 'w') as f:
+        f.write('# ' + ', '.join(names) + '\n')
+        for start in range(0, len(tracks), chunk_size):
+            block = tracks[start:start+chunk_size]
+            np.savetxt(f, np.column_stack([block[name] for name in names]), delimiter=' ')
+
+def import_text(text_file, binary_file, columns=TRACK_COLUMNS):
+    tracks = load_track_list(text_file, columns)
+    np.save(binary_file, tracks)
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser("usage: %prog [options]\n")
+    parser.add_option('-i', '--input', dest='input', help="Input track list (.npy or text)")
+    parser.add_option('-o', '--output', dest='output', help="Output track list (.npy or text)")
+    options, args = parser.parse_args()
+
+    if options.input.endswith('.npy'):
+        export_text(options.input, options.output)
+    else:
+        import_text(options.input, options.output)
+    print("Converted %s -> %s" % (options.input, options.output))
@@ -0,0 +1,62 @@
+# Description: Exact pairing of the events of two PixelAV datasets by their truth (entry position and direction)
+
+import numpy as np
+
+KEY_COLUMNS = slice(0, 6) # x-entry, y-entry, z-entry, n_x, n_y, n_z of the cluster truth
+
+def truth_keys(cluster_truth, columns=KEY_COLUMNS):
+    # Bit patterns of the float64 truth columns, one row per event; -0.0 is mapped to 0.0 so that
+    # only numerically equal values give equal keys
+    values = np.ascontiguousarray(np.asarray(cluster_truth, dtype=np.float64)[:, columns]) + 0.0
+    return values.view(np.uint64)
+
+def hash_keys(keys):
+    # 64-bit FNV-style hash of each key row
+    hashes = np.zeros(len(keys), dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for column in range(keys.shape[1]):
+            hashes = (hashes ^ keys[:, column]) * np.uint64(0x100000001b3)
+            hashes ^= hashes >> np.uint64(29)
+    return hashes
+
+def group_ids(keys):
+    # Same id for identical key rows. Ids come from the hashes; they are checked against the full keys
+    # and, in the (unlikely) case of a hash collision, recomputed from the keys themselves
+    unique_hashes, first, ids = np.unique(hash_keys(keys), return_index=True, return_inverse=True)
+    ids = ids.ravel()
+    if not np.array_equal(keys[first][ids], keys):
+        ids = np.unique(np.ascontiguousarray(keys).view(np.dtype((np.void, keys.itemsize*keys.shape[1]))).ravel(), return_inverse=True)[1].ravel()
+    return ids
+
+def occurrence_rank(ids, counts):
+    # Rank of each event among the events with the same id (0, 1, ... in dataset order), and the events sorted by (id, rank)
+    order = np.argsort(ids, kind='stable')
+    start = np.cumsum(counts) - counts
+    rank = np.empty(len(ids), dtype=np.int64)
+    rank[order] = np.arange(len(ids)) - start[ids[order]]
+    return rank, order, start
+
+def match_events(cluster_truth1, cluster_truth2, columns=KEY_COLUMNS):
+    # Returns (indices1, indices2, report): cluster_truth1[indices1[i]] and cluster_truth2[indices2[i]] have identical keys,
+    # in the order of dataset 2. Events sharing a key are paired one-to-one in order of occurrence
+    keys1 = truth_keys(cluster_truth1, columns)
+    keys2 = truth_keys(cluster_truth2, columns)
+    ids = group_ids(np.concatenate([keys1, keys2]))
+    ids1, ids2 = ids[:len(keys1)], ids[len(keys1):]
+    ngroups = ids.max() + 1 if len(ids) else 0
+    counts1 = np.bincount(ids1, minlength=ngroups)
+    counts2 = np.bincount(ids2, minlength=ngroups)
+    rank1, order1, start1 = occurrence_rank(ids1, counts1)
+    rank2, order2, start2 = occurrence_rank(ids2, counts2)
+    # The n-th event of dataset 2 with a given key is paired with the n-th event of dataset 1 with that key
+    indices2 = np.flatnonzero(rank2 < counts1[ids2])
+    indices1 = order1[start1[ids2[indices2]] + rank2[indices2]]
+    report = {'matched': len(indices2),
+              'unmatched1': len(keys1) - len(indices1), 'unmatched2': len(keys2) - len(indices2),
+              'duplicates1': int(np.sum(counts1[ids1] > 1)), 'duplicates2': int(np.sum(counts2[ids2] > 1))}
+    return indices1, indices2, report
+
+def print_report(report):
+    print("Matched events: ", report['matched'])
+    print("Unmatched events: dataset 1 = ", report['unmatched1'], ", dataset 2 = ", report['unmatched2'])
+    print("Events with a duplicated truth key: dataset 1 = ", report['duplicates1'], ", dataset 2 = ", report['duplicates2'])
@@ -1,18 +1,39 @@
 # Author: Danush Shekar, UIC (April 7, 2024)
 # Description: Used for validating datasets made from Silvaco+PixelAV when compared with DF-ISE+PixelAV
 
+import os
 import sys
+import time
 import numpy as np
 import pandas as pd
 import ROOT
 import matplotlib.pyplot as plt
 import langaus
 import optparse
-from scipy.spatial import KDTree
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pixelav_reader import read_header, iter_events, load_index, select_events, iter_indexed_events, expand_files
+from multiprocessing import Pool
+from cluster_features import cluster_features, FEATURES
+from fast_hist import make_th1, bin_values, add_binned
+from truth_matching import match_events, print_report
+from cluster_store import TRUTH_COLUMNS
+
+STREAM_WINDOW = 10000 # Events per block (and unmatched events kept per dataset) in --stream mode
+# Binning of the histograms and profiles filled by the comparison: name -> (nbins, min, max)
+SINGLE_HIST_BINS = {'sumCharge': (100, 0, 120000), 'xSpan': (20, 0, 20), 'ySpan': (20, 0, 20), 'Area': (40, 0, 40)}
+DELTA_HIST_BINS = (20, -10, 10)
+THETA_BINS = (90, 0, 90)
+STREAM_COLUMNS = ['sumCharge', 'xSpan', 'ySpan', 'Area', 'theta'] # Kept per event, after the 9 truth columns
 
 parser = optparse.OptionParser("usage: %prog [options]\n")
-parser.add_option('-p', '--prodname', dest='filename', help="The name of 1st PixelAV dataset")
-parser.add_option('-c', '--prodname2', dest='filename2', help="The name of 2nd PixelAV dataset")
+parser.add_option('-p', '--prodname', dest='filename', help="The name of 1st PixelAV dataset (can be a glob over chunk outputs, e.g. 'name_*')")
+parser.add_option('-c', '--prodname2', dest='filename2', help="The name of 2nd PixelAV dataset (can be a glob over chunk outputs)")
+parser.add_option('-b', '--benchmark', action='store_true', dest='benchmark', help="Benchmark the batched cluster features against the per-event path on the 1st dataset")
+parser.add_option('-j', '--cores', dest='cores', type='int', default=os.cpu_count(), help="Number of processes used to parse multiple files")
+parser.add_option('--cota', dest='cota_range', type='float', nargs=2, help="Only analyze events with cotAlpha in [MIN, MAX] (uses the .idx.npz index)")
+parser.add_option('--cotb', dest='cotb_range', type='float', nargs=2, help="Only analyze events with cotBeta in [MIN, MAX] (uses the .idx.npz index)")
+parser.add_option('-s', '--stream', action='store_true', dest='stream', help="Stream both datasets and pair events within a bounded window, keeping only the histograms and profiles in memory")
+parser.add_option('-w', '--window', dest='window', type='int', default=STREAM_WINDOW, help="Events read per block and kept while waiting for a match in --stream mode")
 options, args = parser.parse_args()
 
 filename = options.filename
@@ -27,51 +48,15 @@ def analyze(event, threshold):
     return sumCh, x_span, y_span, area
 
 def remove_unmatched_evts(arr_events, cluster_truth, sumCharge, xSpan, ySpan, Area, theta_angle, arr_events2, cluster_truth2, sumCharge2, xSpan2, ySpan2, Area2, theta_angle2):
-    # Convert all inputs to NumPy arrays
-    arr_events = np.array(arr_events)
-    cluster_truth = np.array(cluster_truth)
-    sumCharge = np.array(sumCharge)
-    xSpan = np.array(xSpan)
-    ySpan = np.array(ySpan)
-    Area = np.array(Area)
-    theta_angle = np.array(theta_angle)
-    arr_events2 = np.array(arr_events2)
-    cluster_truth2 = np.array(cluster_truth2)
-    sumCharge2 = np.array(sumCharge2)
-    xSpan2 = np.array(xSpan2)
-    ySpan2 = np.array(ySpan2)
-    Area2 = np.array(Area2)
-    theta_angle2 = np.array(theta_angle2)
-
-    # Build KD-trees for both arrays
-    tree1 = KDTree(cluster_truth[:, 3:6].astype(float))
-    tree2 = KDTree(cluster_truth2[:, 3:6].astype(float))
-    
-    # Query common points using the KD-trees
-    distances, indices_array1 = tree1.query(cluster_truth2[:, 3:6].astype(float), k=1)
-    
-    # Filter out non-matching points based on distances
-    common_indices_array2 = np.where(distances == 0)[0]
-    common_indices_array1 = indices_array1[common_indices_array2]
-    
-    # Select common points from the original arrays
-    tmp_arr_events = arr_events[common_indices_array1]
-    tmp_cluster_truth = cluster_truth[common_indices_array1]
-    tmp_sumCharge = sumCharge[common_indices_array1]
-    tmp_xSpan = xSpan[common_indices_array1]
-    tmp_ySpan = ySpan[common_indices_array1]
-    tmp_Area = Area[common_indices_array1]
-    tmp_theta_angle = theta_angle[common_indices_array1]
-    
-    tmp_arr_events2 = arr_events2[common_indices_array2]
-    tmp_cluster_truth2 = cluster_truth2[common_indices_array2]
-    tmp_sumCharge2 = sumCharge2[common_indices_array2]
-    tmp_xSpan2 = xSpan2[common_indices_array2]
-    tmp_ySpan2 = ySpan2[common_indices_array2]
-    tmp_Area2 = Area2[common_indices_array2]
-    tmp_theta_angle2 = theta_angle2[common_indices_array2]
+    # Keep only the events whose truth (entry position and direction) appears in both datasets, paired one-to-one
+    # and in the order of dataset 2
+    common_indices_array1, common_indices_array2, report = match_events(cluster_truth, cluster_truth2)
+    print_report(report)
 
-    return (tmp_arr_events, tmp_cluster_truth, tmp_sumCharge, tmp_xSpan, tmp_ySpan, tmp_Area, tmp_theta_angle, tmp_arr_events2, tmp_cluster_truth2, tmp_sumCharge2, tmp_xSpan2, tmp_ySpan2, tmp_Area2, tmp_theta_angle2)
+    # Select common points from the original arrays
+    arrays1 = (arr_events, cluster_truth, sumCharge, xSpan, ySpan, Area, theta_angle)
+    arrays2 = (arr_events2, cluster_truth2, sumCharge2, xSpan2, ySpan2, Area2, theta_angle2)
+    return tuple(np.asarray(arr)[common_indices_array1] for arr in arrays1) + tuple(np.asarray(arr)[common_indices_array2] for arr in arrays2)
 
 
 def count_above_threshold(arr, threshold):
@@ -107,75 +92,93 @@ def find_second_max(arr):
     (second_max_idx, second_max_idy) = np.unravel_index(second_max_idx_flat, arr.shape)
     return second_max_val, (second_max_idx, second_max_idy)
 
-def parse_file(filein, threshold):
-    with open(filein) as f:
-        lines = f.readlines()
-
-    header = lines.pop(0).strip()
-    pixelstats = lines.pop(0).strip()
+def open_event_reader(filein, cota_range=None, cotb_range=None):
+    # Events are read lazily, one <cluster> block at a time
+    if cota_range is None and cotb_range is None:
+        return iter_events(filein)
+    # Seek straight to the selected events using the sidecar index (built on the first run)
+    index = load_index(filein)
+    selected = select_events(index, cota_range, cotb_range)
+    print("Selected events: ", len(selected), " of ", len(index['offsets']))
+    return iter_indexed_events(filein, selected, index)
+
+def parse_file(filein, threshold, cota_range=None, cotb_range=None):
+    header, pixelstats = read_header(filein)
     print("Header: ", header)
     print("Pixelstats: ", pixelstats)
 
-    counter = 0 # For running on mini dataset for debugging
     events = []
-    sumCharge = []
-    xSpan = []
-    ySpan = []
-    Area = []
-    theta_angle = []
-    cur_event = []
     cluster_truth = []
-    b_geteventinfo = False
-    b_getclusterinfo = False
-
-    for line in lines:
-        # if (counter == 10):
-        #     break
-        if "<cluster>" in line:
-            b_geteventinfo = False
-            b_getclusterinfo = True
-            if cur_event:  # Only append if cur_event is not empty
-                counter += 1
-                sumCh, x_span, y_span, area = analyze(np.array(cur_event), threshold)
-                sumCharge.append(sumCh)
-                xSpan.append(x_span)
-                ySpan.append(y_span)
-                Area.append(area)
-                events.append(np.array(cur_event))
-            cur_event = []
-            continue
-        if b_getclusterinfo:
-                cluster_truth.append(line.strip().split())
-                b_getclusterinfo = False
-        if "<time slice 4000" in line:
-            cur_event = []
-            b_geteventinfo = True
-            continue
-        if b_geteventinfo == True:
-                cur_event.append([float(i) for i in line.strip().split()])
-
-    # Handle the last event
-    if cur_event:
-        events.append(np.array(cur_event))
-        sumCh, x_span, y_span, area = analyze(np.array(cur_event), threshold)
-        sumCharge.append(sumCh)
-        xSpan.append(x_span)
-        ySpan.append(y_span)
-        Area.append(area)
-    # Convert list of arrays to a 3D numpy array
-    events = np.array(events)
-    cluster_truth = np.array(cluster_truth)
-    for iter in range(len(cluster_truth)):
-        theta_angle.append(find_angle(cluster_truth[iter, 3:6].astype(float)))
+
+    event_reader = open_event_reader(filein, cota_range, cotb_range)
+    for truth, cur_event in event_reader:
+        events.append(cur_event)
+        cluster_truth.append(truth)
+    # Convert list of arrays to a 3D numpy array; a chunk still being written by PixelAV (or a cotAlpha/cotBeta
+    # selection) can give no event at all
+    events = np.array(events) if events else np.zeros((0, 0, 0))
+    cluster_truth = np.array(cluster_truth).reshape(len(events), len(TRUTH_COLUMNS))
+    # Features of all events at once, with reductions over the event tensor
+    features = cluster_features(events, cluster_truth, threshold)
+    sumCharge = features['sumCharge']
+    xSpan = features['xSpan']
+    ySpan = features['ySpan']
+    Area = features['Area']
+    theta_angle = features['theta']
     print("events len = ",len(events), ", area len = ", len(Area), ", cluster truth len = ", len(cluster_truth))
     return (events, cluster_truth, sumCharge, xSpan, ySpan, Area, theta_angle)
 
-def delta_histograms(arr1, arr2, name, unit):
-    delta = np.array(arr1) - np.array(arr2)
+def benchmark_features(arr_events, cluster_truth, threshold):
+    # Compare the per-event functions (analyze, find_angle, find_second_max) with the batched cluster_features
+    per_event = {name: [] for name in FEATURES}
+    start = time.perf_counter()
+    for iter in range(len(arr_events)):
+        sumCh, x_span, y_span, area = analyze(arr_events[iter], threshold)
+        per_event['sumCharge'].append(sumCh)
+        per_event['xSpan'].append(x_span)
+        per_event['ySpan'].append(y_span)
+        per_event['Area'].append(area)
+        per_event['maxCharge'].append(np.amax(arr_events[iter]))
+        per_event['secondMaxCharge'].append(find_second_max(arr_events[iter])[0])
+        per_event['theta'].append(find_angle(cluster_truth[iter, 3:6].astype(float)))
+    loop_time = time.perf_counter() - start
+    start = time.perf_counter()
+    features = cluster_features(arr_events, cluster_truth, threshold)
+    batch_time = time.perf_counter() - start
+    print(f"Per-event: {loop_time:.3f} s, batched: {batch_time:.3f} s, speed-up = {loop_time/batch_time:.1f}x")
+    for name in FEATURES:
+        print(f"{name}: agree = {np.allclose(per_event[name], features[name])}")
+
+def parse_files(pattern, threshold, cota_range=None, cotb_range=None, ncores=1):
+    # pattern can be a glob matching the chunk outputs of job_submit.py: the files are parsed in a process pool
+    # and the per-chunk arrays and summary statistics are merged in chunk order
+    files = expand_files(pattern)
+    if not files:
+        print("No input files match ", pattern)
+        exit(1)
+    if len(files) == 1:
+        return parse_file(files[0], threshold, cota_range, cotb_range)
+    print("Input files: ", files)
+    with Pool(min(ncores, len(files))) as pool:
+        results = pool.starmap(parse_file, [(name, threshold, cota_range, cotb_range) for name in files])
+    # Files without events are left out of the event tensor, whose pixel shape they do not know
+    events = [result[0] for result in results if len(result[0])]
+    events = np.concatenate(events) if events else results[0][0]
+    cluster_truth = np.concatenate([result[1] for result in results])
+    merged = [events, cluster_truth]
+    for iter in range(2, len(results[0])):
+        merged.append(np.concatenate([result[iter] for result in results]))
+    print("Merged events len = ", len(events))
+    return tuple(merged)
+
+def delta_histograms(arr1, arr2, name, unit, binned=None):
+    # binned: (contents, stats) accumulated by the streaming comparison, used instead of arr1 - arr2
     canvas = ROOT.TCanvas("cv","cv",1000,800)
-    hist_tmp = ROOT.TH1F(name, 'delta '+f'{name}', 20, -10, 10)
-    for iter in range(len(delta)):
-        hist_tmp.Fill(delta[iter])
+    # Binned with NumPy, ROOT only receives the bin contents
+    if binned is None:
+        hist_tmp = make_th1(name, 'delta '+f'{name}', 20, -10, 10, np.asarray(arr1) - np.asarray(arr2))
+    else:
+        hist_tmp = make_th1(name, 'delta '+f'{name}', 20, -10, 10, binned=binned)
     myMean = hist_tmp.GetMean()
     myRMS = hist_tmp.GetRMS()
     hist_tmp.Draw("hist")
@@ -188,17 +191,13 @@ def delta_histograms(arr1, arr2, name, unit):
     canvas.SaveAs("./delta_"+name+"_hist.png")
     canvas.Clear()
 
-def single_histogram(arr, arr2, name, unit, maxbin, nbins, doFit=False, iter=1):
+def single_histogram(arr, arr2, name, unit, maxbin, nbins, doFit=False, iter=1, binned1=None, binned2=None):
     canvas = ROOT.TCanvas(f"cv_{iter}", f"cv_{iter}",1000,800)
-    # Create and fill the first histogram
-    hist_tmp1 = ROOT.TH1F(f'{name}_1', f'{name}', nbins, 0, maxbin)
-    for value in arr:
-        hist_tmp1.Fill(value)
+    # Create and fill the first histogram (from arr, or from the (contents, stats) of the streaming comparison)
+    hist_tmp1 = make_th1(f'{name}_1', f'{name}', nbins, 0, maxbin, arr, binned1)
 
     # Create and fill the second histogram
-    hist_tmp2 = ROOT.TH1F(f'{name}_2', f'{name}', nbins, 0, maxbin)
-    for value in arr2:
-        hist_tmp2.Fill(value)
+    hist_tmp2 = make_th1(f'{name}_2', f'{name}', nbins, 0, maxbin, arr2, binned2)
 
     ROOT.gStyle.SetOptStat(0)  # Turn off automatic stats box
     hist_tmp1.GetXaxis().SetTitle(name+" ["+unit+"]")
@@ -231,13 +230,172 @@ def single_histogram(arr, arr2, name, unit, maxbin, nbins, doFit=False, iter=1):
     canvas.SaveAs("./"+name+"_hist.png")
     canvas.Clear()
 
+def iter_feature_blocks(pattern, threshold, block_size, cota_range=None, cotb_range=None):
+    # Yields (block of [truth | STREAM_COLUMNS] rows, max pixel charge) for every block_size events of the files
+    # matching pattern; only one block of pixel matrices is held at a time
+    events = []
+    cluster_truth = []
+    for filein in expand_files(pattern):
+        for truth, cur_event in open_event_reader(filein, cota_range, cotb_range):
+            events.append(cur_event)
+            cluster_truth.append(truth)
+            if len(events) == block_size:
+                yield feature_block(events, cluster_truth, threshold)
+                events = []
+                cluster_truth = []
+    if events:
+        yield feature_block(events, cluster_truth, threshold)
+
+def feature_block(events, cluster_truth, threshold):
+    events = np.array(events)
+    cluster_truth = np.array(cluster_truth).reshape(len(events), -1)
+    features = cluster_features(events, cluster_truth, threshold)
+    return np.column_stack([cluster_truth] + [features[name] for name in STREAM_COLUMNS]), np.amax(events)
+
+def new_comparison():
+    # Everything the comparison plots, filled incrementally from matched pairs
+    nbins, xmin, xmax = THETA_BINS
+    comparison = {'matched': 0, 'unmatched1': 0, 'unmatched2': 0, 'max1': -np.inf, 'max2': -np.inf}
+    for name, (nbins_hist, min_hist, max_hist) in SINGLE_HIST_BINS.items():
+        comparison[name+'1'] = bin_values([], nbins_hist, min_hist, max_hist)
+        comparison[name+'2'] = bin_values([], nbins_hist, min_hist, max_hist)
+    for name in ('xSpan', 'ySpan'):
+        comparison['delta_'+name] = bin_values([], *DELTA_HIST_BINS)
+    # Per-theta profiles of the cluster size: [entries, sum, sum of squares] per theta bin
+    for name in ('Area1', 'Area2', 'deltaArea'):
+        comparison['profile_'+name] = np.zeros((3, nbins))
+    return comparison
+
+def fill_profile(profile, theta, values):
+    nbins, xmin, xmax = THETA_BINS
+    bins = np.clip(np.floor((theta - xmin)*(nbins/(xmax - xmin))), 0, nbins - 1).astype(np.int64)
+    profile[0] += np.bincount(bins, minlength=nbins)
+    profile[1] += np.bincount(bins, weights=values, minlength=nbins)
+    profile[2] += np.bincount(bins, weights=values**2, minlength=nbins)
+
+def fill_comparison(comparison, rows1, rows2):
+    # rows1[i] and rows2[i] are the same event simulated with the two field maps
+    features1 = {name: rows1[:, 9+iter] for iter, name in enumerate(STREAM_COLUMNS)}
+    features2 = {name: rows2[:, 9+iter] for iter, name in enumerate(STREAM_COLUMNS)}
+    comparison['matched'] += len(rows1)
+    for name, bins in SINGLE_HIST_BINS.items():
+        comparison[name+'1'] = add_binned(comparison[name+'1'], bin_values(features1[name], *bins))
+        comparison[name+'2'] = add_binned(comparison[name+'2'], bin_values(features2[name], *bins))
+    for name in ('xSpan', 'ySpan'):
+        comparison['delta_'+name] = add_binned(comparison['delta_'+name], bin_values(features1[name] - features2[name], *DELTA_HIST_BINS))
+    fill_profile(comparison['profile_Area1'], features1['theta'], features1['Area'])
+    fill_profile(comparison['profile_Area2'], features2['theta'], features2['Area'])
+    fill_profile(comparison['profile_deltaArea'], features1['theta'], features1['Area'] - features2['Area'])
+
+def stream_compare(pattern1, pattern2, threshold, window=STREAM_WINDOW, cota_range=None, cotb_range=None):
+    # Reads both datasets block by block and pairs events by truth key (see truth_matching.match_events).
+    # Events without a partner yet wait for the next blocks; at most window of them are kept per dataset,
+    # the oldest ones are counted as unmatched. Memory depends on window, not on the number of events
+    comparison = new_comparison()
+    blocks1 = iter_feature_blocks(pattern1, threshold, window, cota_range, cotb_range)
+    blocks2 = iter_feature_blocks(pattern2, threshold, window, cota_range, cotb_range)
+    pending1 = np.zeros((0, 9+len(STREAM_COLUMNS)))
+    pending2 = np.zeros((0, 9+len(STREAM_COLUMNS)))
+    while True:
+        block1 = next(blocks1, None)
+        block2 = next(blocks2, None)
+        if block1 is None and block2 is None:
+            break
+        if block1 is not None:
+            pending1 = np.concatenate([pending1, block1[0]])
+            comparison['max1'] = max(comparison['max1'], block1[1])
+        if block2 is not None:
+            pending2 = np.concatenate([pending2, block2[0]])
+            comparison['max2'] = max(comparison['max2'], block2[1])
+        indices1, indices2, report = match_events(pending1[:, :9], pending2[:, :9])
+        fill_comparison(comparison, pending1[indices1], pending2[indices2])
+        pending1 = np.delete(pending1, indices1, axis=0)
+        pending2 = np.delete(pending2, indices2, axis=0)
+        comparison['unmatched1'] += max(len(pending1) - window, 0)
+        comparison['unmatched2'] += max(len(pending2) - window, 0)
+        pending1 = pending1[-window:]
+        pending2 = pending2[-window:]
+        print("Matched events: ", comparison['matched'])
+    comparison['unmatched1'] += len(pending1)
+    comparison['unmatched2'] += len(pending2)
+    return comparison
+
+def profile_mean_std(profile):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = profile[1]/profile[0]
+        std = np.sqrt(np.maximum(profile[2]/profile[0] - mean**2, 0))
+    return mean, std
+
+def plot_profile(ax, profile, color, label):
+    nbins, xmin, xmax = THETA_BINS
+    centers = xmin + (np.arange(nbins) + 0.5)*(xmax - xmin)/nbins
+    mean, std = profile_mean_std(profile)
+    filled = profile[0] > 0
+    ax.errorbar(centers[filled], mean[filled], yerr=std[filled], color=color, fmt='o', markersize=3, label=label)
+
+def plot_comparison(comparison):
+    # Same plots as the in-memory comparison; the scatter plots become per-theta profiles (mean +/- std. dev.)
+    print("Matched events: ", comparison['matched'])
+    print("Unmatched events: dataset 1 = ", comparison['unmatched1'], ", dataset 2 = ", comparison['unmatched2'])
+    print("The max value in the array 1 is: ", comparison['max1'])
+    print("The max value in the array 2 is: ", comparison['max2'])
+
+    fig, axs = plt.subplots(2)
+    plot_profile(axs[0], comparison['profile_Area1'], 'red', 'Silvaco')
+    axs[0].set_xlabel('Theta (angle w.r.t. Z-axis) [deg.]')
+    axs[0].set_ylabel('Total cluster size [pixel]')
+    axs[0].set_title('Silvaco: Total cluster size vs Theta')
+    axs[0].legend()
+    axs[0].grid(True)
+    axs[0].set_xticks(np.arange(0, 91, 10))  # Set x-axis ticks
+    plot_profile(axs[1], comparison['profile_Area2'], 'black', 'DF-ISE')
+    axs[1].set_xlabel('Theta (angle w.r.t. Z-axis) [deg.]')
+    axs[1].set_ylabel('Total cluster size [pixel]')
+    axs[1].set_title('DF-ISE: Total cluster size vs Theta')
+    axs[1].legend()
+    axs[1].grid(True)
+    axs[1].set_xticks(np.arange(0, 91, 10))  # Set x-axis ticks
+    plt.tight_layout()
+    plt.savefig('./clusterSize_vs_theta_plot.png')
+
+    fig, ax = plt.subplots()
+    plot_profile(ax, comparison['profile_deltaArea'], 'red', 'Silvaco - DF-ISE')
+    ax.set_xlabel('Theta (angle w.r.t. Z-axis) [deg.]')
+    ax.set_ylabel('Delta cluster size [pixel]')
+    ax.set_title('Delta cluster size vs Theta')
+    ax.legend()
+    ax.grid(True)
+    plt.savefig('./deltaClusterSize_vs_theta_plot.png')
+
+    for name, unit in (('xSpan', 'pixel'), ('ySpan', 'pixel')):
+        delta_histograms(None, None, name, unit, binned=comparison['delta_'+name])
+
+    single_hist_doFit = [True, False, False, False]
+    single_hist_units = ['e', 'pixel', 'pixel', 'pixel']
+    for i, (name, (nbins, xmin, xmax)) in enumerate(SINGLE_HIST_BINS.items()):
+        single_histogram(None, None, name, single_hist_units[i], xmax, nbins, single_hist_doFit[i], i, comparison[name+'1'], comparison[name+'2'])
+
 def main():
 
-    (arr_events, cluster_truth, sumCharge, xSpan, ySpan, Area, theta_angle) = parse_file(filein="../Runs/"+filename+".out", threshold=10)
+    if options.stream:
+        comparison = stream_compare("../Runs/"+filename+".out", "../Runs/"+filename2+".out", threshold=10, window=options.window, cota_range=options.cota_range, cotb_range=options.cotb_range)
+        plot_comparison(comparison)
+        return
+
+    (arr_events, cluster_truth, sumCharge, xSpan, ySpan, Area, theta_angle) = parse_files("../Runs/"+filename+".out", threshold=10, cota_range=options.cota_range, cotb_range=options.cotb_range, ncores=options.cores)
     print("Done analyzing dataset 1.")
+    if len(arr_events) == 0:
+        print("No events in dataset 1, nothing to compare.")
+        return
+    if options.benchmark:
+        benchmark_features(arr_events, cluster_truth, threshold=10)
+        return
     print(cluster_truth[-1], Area[-1])
-    (arr_events2, cluster_truth2, sumCharge2, xSpan2, ySpan2, Area2, theta_angle2) = parse_file(filein="../Runs/"+filename2+".out", threshold=10)
+    (arr_events2, cluster_truth2, sumCharge2, xSpan2, ySpan2, Area2, theta_angle2) = parse_files("../Runs/"+filename2+".out", threshold=10, cota_range=options.cota_range, cotb_range=options.cotb_range, ncores=options.cores)
     print("Done analyzing dataset 2.")
+    if len(arr_events2) == 0:
+        print("No events in dataset 2, nothing to compare.")
+        return
 
 
     (arr_events, cluster_truth, sumCharge, xSpan, ySpan, Area, theta_angle, arr_events2, cluster_truth2, sumCharge2, xSpan2, ySpan2, Area2, theta_angle2) = remove_unmatched_evts(arr_events, cluster_truth, sumCharge, xSpan, ySpan, Area, theta_angle, arr_events2, cluster_truth2, sumCharge2, xSpan2, ySpan2, Area2, theta_angle2)
@@ -1,13 +1,21 @@
 # Author: Danush Shekar, UIC (May 2, 2024)
 # Description: Used for validating Silvaco simulation data when compared with DF-ISE data
 
-import math
+import os
+import io
+import contextlib
+import multiprocessing
 import numpy as np
+import matplotlib
+matplotlib.use('Agg') # Plots are only saved to files, also from worker processes
 import matplotlib.pyplot as plt
 import csv
 import sys
 import optparse
 import pandas as pd
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import dfise
+from mesh_interp import METHODS, IDW_NEIGHBOURS, mesh_tree, mesh_triangulation, closest_point_indices, interpolate
 
 parser = optparse.OptionParser("usage: %prog [options]\n")
 parser.add_option('-e', '--pltEF', action='store_true', dest='pltEF', help="Plot electric fields")
@@ -15,90 +23,177 @@ parser.add_option('-w', '--pltWP', action='store_true', dest='pltWP', help="Plot
 parser.add_option('-E', '--pltEF2d', action='store_true', dest='pltEF2d', help="Plot 2D electric fields")
 parser.add_option('-W', '--pltWP2d', action='store_true', dest='pltWP2d', help="Plot 2D weighting potentials")
 parser.add_option('-d', '--pltDop', action='store_true', dest='pltDop', help="Plot doping conc.")
+parser.add_option('-i', '--interp', dest='interp', type='choice', choices=METHODS, default='nearest', help="Value at a probe point: nearest mesh vertex, linear (Delaunay, cached as <mesh>.delaunay.pkl) or idw [default: %default]")
+parser.add_option('-k', '--neighbours', dest='neighbours', type='int', default=IDW_NEIGHBOURS, help="Mesh vertices used per point with --interp idw [default: %default]")
+parser.add_option('-D', '--diff3d', action='store_true', dest='diff3d', help="Resample both meshes on a common regular grid and write the |dE| and dWP volumes (fieldDiff_*.npy)")
+parser.add_option('--spacing', dest='spacing', type='float', nargs=3, default=(1.0, 1.0, 1.0), help="Grid spacing DX DY DZ [um] of the --diff3d grid [default: %default]")
+parser.add_option('-j', '--cores', dest='cores', type='int', default=os.cpu_count(), help="Number of processes plotting the probe lines [default: %default]")
+parser.add_option('-f', '--file', dest='files', action='append', default=[], metavar='NAME=PATH', help="Use PATH as input NAME (e.g. mesh_EFMorris=../prod/prod_msh.grd, EFMorris=../prod/prod_100_des.dat); DF-ISE _msh.grd/_des.dat files are read directly")
 options, args = parser.parse_args()
 
+# Input files, by name; text files as prepared by hand, or DF-ISE grid / dataset files
+input_files = {'mesh_EF': 'mesh_EF.txt', 'EF': 'EF.txt', 'mesh_EFMorris': 'mesh_EFMorris.txt', 'EFMorris': 'EFMorris.txt',
+               'mesh_Wpot': 'mesh_Wpot.txt', 'Wpot': 'Wpot.txt', 'mesh_WpotMorris': 'mesh_WpotMorris.txt', 'WpotMorris': 'WpotMorris.txt',
+               'Abs_dop_conc': 'Abs_dop_conc.csv', 'B_conc': 'B_conc.csv', 'P_conc': 'P_conc.csv'}
+for name_path in options.files:
+    name, file_path = name_path.split('=', 1)
+    if name not in input_files:
+        parser.error("Unknown input " + name + ", choose from " + ", ".join(input_files))
+    input_files[name] = file_path
+
 pltEF = options.pltEF
 pltWP = options.pltWP
 pltEF2d = options.pltEF2d
 pltWP2d = options.pltWP2d
 pltDop = options.pltDop
 
-if not (pltEF or pltWP or pltEF2d or pltWP2d or pltDop):
+if not (pltEF or pltWP or pltEF2d or pltWP2d or pltDop or options.diff3d):
     print("Choose atleast one plotting-task.")
     exit()
 
-def read_mesh(file_name):
-    with open(file_name, 'r') as file:
-        return [list(map(float, line.split())) for line in file]
-    
-def read_conc(file_name):
-    with open(file_name, 'r') as file:
-        data = [float(line.strip()) for line in file]
+def load_cached(file_name, parse):
+    # Parsed arrays are mirrored in <file_name>.npy and reused as long as the text file is not newer
+    cache_file = file_name + '.npy'
+    if os.path.exists(cache_file) and os.path.getmtime(cache_file) >= os.path.getmtime(file_name):
+        return np.load(cache_file)
+    data = parse(file_name)
+    try:
+        np.save(cache_file, data)
+    except OSError:
+        print("Could not cache ", file_name, " in ", cache_file)
     return data
 
-def calculate_distance(point1, point2):
-    return math.sqrt(sum((x - y) ** 2 for x, y in zip(point1, point2)))
+def read_values(file_name):
+    # All whitespace-separated floats of a text file, as one contiguous float64 array
+    with open(file_name, 'r') as file:
+        return np.fromstring(file.read(), dtype=np.float64, sep=' ')
 
-def calculate_magnitude(vector):
-    return math.sqrt(sum(x ** 2 for x in vector))
+def read_mesh(file_name):
+    # One mesh point per line: [npoints, ncoordinates]; or the vertices of a DF-ISE grid
+    if dfise.is_dfise(file_name):
+        return dfise.read_vertices(file_name)
+    def parse(file_name):
+        with open(file_name, 'r') as file:
+            ncols = len(file.readline().split())
+        return read_values(file_name).reshape(-1, ncols)
+    return load_cached(file_name, parse)
+    
+def read_conc(file_name):
+    if dfise.is_dfise(file_name):
+        return np.ravel(dfise.read_values(file_name))
+    return load_cached(file_name, read_values)
 
 def read_EF(file_path):
-    with open(file_path, 'r') as file:
-        data = []
-        row = []
-        for line in file:
-            for value in line.split():
-                row.append(float(value))
-                if len(row) == 3:  # If we have collected X, Y, Z components for a point
-                    data.append(row)
-                    row = []  # Start a new row
-    return data
+    # X, Y, Z components for every point: [npoints, 3]; or the first dataset of a DF-ISE file
+    if dfise.is_dfise(file_path):
+        return np.reshape(dfise.read_values(file_path), (-1, 3))
+    def parse(file_path):
+        data = read_values(file_path)
+        return data[:len(data)//3*3].reshape(-1, 3)
+    return load_cached(file_path, parse)
 
-def find_EF(electric_fields, line, mesh_points):
-    EF = []
-    for point in line:
-        closest_point_index = min(range(len(mesh_points)), key=lambda i: calculate_distance(point, mesh_points[i]))
-        closest_point = mesh_points[closest_point_index]
-        print(f"Closest point to {point} is {closest_point}: {electric_fields[closest_point_index]}")
-        EF.append(calculate_magnitude(electric_fields[closest_point_index]))
-    return EF
+def find_EF(electric_fields, line, mesh_points, mesh_file, method='nearest'):
+    # Search structures (KD-tree, triangulation) are built once per mesh file and shared by all probe lines
+    if method != 'nearest':
+        fields = interpolate(electric_fields, line, mesh_file, mesh_points, method, options.neighbours)
+        for point, field in zip(line, fields):
+            print(f"Interpolated ({method}) value at {point}: {field}")
+        return list(np.linalg.norm(fields, axis=1))
+    closest_point_index = closest_point_indices(mesh_tree(mesh_file, mesh_points), line)
+    for point, closest_point, field in zip(line, mesh_points[closest_point_index], electric_fields[closest_point_index]):
+        print(f"Closest point to {point} is {closest_point.tolist()}: {field.tolist()}")
+    return list(np.linalg.norm(electric_fields[closest_point_index], axis=1))
 
 def read_WP(file_path):
-    with open(file_path, 'r') as file:
-        data = []
-        row = []
-        for line in file:
-            for value in line.split():
-                data.append(float(value))
-    return data
+    if dfise.is_dfise(file_path):
+        return np.ravel(dfise.read_values(file_path))
+    return load_cached(file_path, read_values)
 
-def find_WP(weighting_pots, line, mesh_points):
-    WP = []
-    for point in line:
-        closest_point_index = min(range(len(mesh_points)), key=lambda i: calculate_distance(point, mesh_points[i]))
-        closest_point = mesh_points[closest_point_index]
-        print(f"Closest point to {point} is {closest_point}: {weighting_pots[closest_point_index]}")
-        WP.append(weighting_pots[closest_point_index])
-    return WP
-
-def find_doping(arr, line, mesh_points):
-    doping = []
-    for point in line:
-        closest_point_index = min(range(len(mesh_points)), key=lambda i: calculate_distance(point, mesh_points[i]))
-        doping.append(arr[closest_point_index])
-    return doping
+def find_WP(weighting_pots, line, mesh_points, mesh_file, method='nearest'):
+    if method != 'nearest':
+        WP = list(interpolate(weighting_pots, line, mesh_file, mesh_points, method, options.neighbours))
+        for point, value in zip(line, WP):
+            print(f"Interpolated ({method}) value at {point}: {value}")
+        return WP
+    closest_point_index = closest_point_indices(mesh_tree(mesh_file, mesh_points), line)
+    for point, closest_point, value in zip(line, mesh_points[closest_point_index], weighting_pots[closest_point_index]):
+        print(f"Closest point to {point} is {closest_point.tolist()}: {value}")
+    return list(weighting_pots[closest_point_index])
 
-# Define the line along which the electric field is to be plotted
-if(pltWP):
-    coordinates = [[110, 20], [43.875, 15.625], [11, 2], [20, 3], [100, 25]]
-elif(pltEF):
-    coordinates = [[11, 2], [17, 3], [2, 1], [23, 5]]
+def find_doping(arr, line, mesh_points, mesh_file, method='nearest'):
+    return list(interpolate(arr, line, mesh_file, mesh_points, method, options.neighbours))
 
-for iter in range(len(coordinates)):
+CHUNK_POINTS = 1000000 # Grid points interpolated at a time in --diff3d mode
+DIFF_PERCENTILES = [50, 90, 99, 99.9]
+DIFF_BINS = np.concatenate([[0], np.logspace(-12, 12, 2401)]) # Bins of the absolute differences, for the percentiles
+
+def common_grid(mesh_points_list, spacing):
+    # Regular grid axes covering the region inside the bounding boxes of all meshes
+    lower = np.max([np.min(mesh_points, axis=0) for mesh_points in mesh_points_list], axis=0)
+    upper = np.min([np.max(mesh_points, axis=0) for mesh_points in mesh_points_list], axis=0)
+    return [lower[i] + np.arange(int(np.floor((upper[i] - lower[i])/spacing[i] + 1e-9)) + 1)*spacing[i] for i in range(3)]
+
+def histogram_percentiles(counts, percentiles, maximum):
+    # Percentiles interpolated linearly within the bin in which each of them falls, capped at the largest value
+    # so that they never exceed it
+    cumulative = np.cumsum(counts)
+    targets = np.asarray(percentiles)/100*cumulative[-1]
+    bins = np.minimum(np.searchsorted(cumulative, targets), len(counts) - 1)
+    fractions = (targets - (cumulative[bins] - counts[bins]))/np.maximum(counts[bins], 1)
+    values = DIFF_BINS[bins] + fractions*(DIFF_BINS[bins + 1] - DIFF_BINS[bins])
+    return np.minimum(values, maximum).tolist()
+
+def write_difference_map(out_file, grid, difference):
+    # difference(points) returns one value per grid point. The grid is processed a few z planes at a time, straight
+    # into a float32 .npy volume indexed [z, y, x]; only a histogram of the absolute differences is kept for the summary
+    x, y, z = grid
+    nz_chunk = max(1, CHUNK_POINTS//(len(x)*len(y)))
+    volume = np.lib.format.open_memmap(out_file, mode='w+', dtype=np.float32, shape=(len(z), len(y), len(x)))
+    counts = np.zeros(len(DIFF_BINS) - 1, dtype=np.int64)
+    total = 0.0
+    maximum = 0.0
+    for z_start in range(0, len(z), nz_chunk):
+        zz, yy, xx = np.meshgrid(z[z_start:z_start+nz_chunk], y, x, indexing='ij')
+        values = difference(np.column_stack([xx.ravel(), yy.ravel(), zz.ravel()]))
+        volume[z_start:z_start+nz_chunk] = values.reshape(zz.shape)
+        abs_values = np.abs(values)
+        counts += np.histogram(abs_values, DIFF_BINS)[0]
+        total += np.sum(abs_values)
+        maximum = max(maximum, np.max(abs_values))
+    volume.flush()
+    del volume
+    summary = {'voxels': len(x)*len(y)*len(z), 'mean': total/(len(x)*len(y)*len(z)), 'max': maximum}
+    summary.update({f'p{q}': value for q, value in zip(DIFF_PERCENTILES, histogram_percentiles(counts, DIFF_PERCENTILES, maximum))})
+    return summary
+
+def field_difference_maps(spacing, method):
+    # Silvaco vs DF-ISE over the whole volume: |E1 - E2| and WP1 - WP2 on a common regular grid
+    pairs = [('dE', input_files['mesh_EF'], input_files['EF'], input_files['mesh_EFMorris'], input_files['EFMorris'], read_EF),
+             ('dWP', input_files['mesh_Wpot'], input_files['Wpot'], input_files['mesh_WpotMorris'], input_files['WpotMorris'], read_WP)]
+    pairs = [pair for pair in pairs if all(os.path.exists(name) for name in pair[1:5])]
+    meshes = {pair[0]: (read_mesh(pair[1]), pair[5](pair[2]), read_mesh(pair[3]), pair[5](pair[4])) for pair in pairs}
+    grid = common_grid([mesh[0] for mesh in meshes.values()] + [mesh[2] for mesh in meshes.values()], spacing)
+    np.savez('fieldDiff_grid.npz', x=grid[0], y=grid[1], z=grid[2])
+    print("Common grid: ", [len(axis) for axis in grid], " points from ", [float(axis[0]) for axis in grid], " to ", [float(axis[-1]) for axis in grid], " um")
+    for name, mesh_file1, file1, mesh_file2, file2, reader in pairs:
+        mesh_points1, values1, mesh_points2, values2 = meshes[name]
+        def difference(points):
+            delta = interpolate(values1, points, mesh_file1, mesh_points1, method, options.neighbours) - interpolate(values2, points, mesh_file2, mesh_points2, method, options.neighbours)
+            return np.linalg.norm(delta, axis=1) if delta.ndim > 1 else delta
+        summary = write_difference_map('fieldDiff_'+name+'.npy', grid, difference)
+        unit = 'V/cm' if name == 'dE' else 'V'
+        print(f"|{name}| ({method}) over {summary['voxels']} voxels: mean = {summary['mean']:.4g} {unit}, max = {summary['max']:.4g} {unit}")
+        print("    " + ", ".join(f"p{q} = {summary[f'p{q}']:.4g} {unit}" for q in DIFF_PERCENTILES))
+
+if options.diff3d:
+    field_difference_maps(options.spacing, options.interp)
+    if not (pltEF or pltWP or pltDop):
+        exit()
+
+def probe_line(y_cor, z_cor):
+    # Points along the depth (x) at (y_cor, z_cor), denser close to the surfaces
     line = []
     # 100 125 31.25
-    y_cor = coordinates[iter][0]
-    z_cor = coordinates[iter][1]
     for x in np.arange(0, 5, 0.3):
         line.append([x, y_cor, z_cor])
     for x in np.arange(5, 85, 5):
@@ -107,7 +202,6 @@ for iter in range(len(coordinates)):
         line.append([x, y_cor, z_cor])
     for x in np.arange(97, 100, 0.3):
         line.append([x, y_cor, z_cor])
-    x_coordinates = [point[0] for point in line]
 
     # line = []
     # x_cor = 99.0
@@ -117,80 +211,121 @@ for iter in range(len(coordinates)):
     # for x in np.arange(6, 6.25, 0.1):
     #     line.append([x_cor, y_cor, x])
     # line.append([x_cor, y_cor, 6.25])
+    return line
+
+def plot_line(iter):
+    # Lookup, CSV and plot of one probe line. Runs in a worker process with its own figure; the printout is
+    # returned so that the lines are reported in order
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        y_cor = coordinates[iter][0]
+        z_cor = coordinates[iter][1]
+        line = probe_line(y_cor, z_cor)
+        x_coordinates = [point[0] for point in line]
+        fig, ax = plt.subplots()
+
+        # Create the plot
+        if(pltEF):
+            print("\n\nSILVACO\n\n")
+            EF = find_EF(electric_fields, line, mesh_points_EF, input_files['mesh_EF'], options.interp)
+            print("\n\nDF-ISE\n\n")
+            EF2 = find_EF(electric_fields2, line, mesh_points_EF2, input_files['mesh_EFMorris'], options.interp)
+            save_data_EF = list(zip(x_coordinates, EF))
+            # Write EF data to a CSV file
+            with open('parsedEFdataVsDepth_at_'+str(y_cor)+'_'+str(z_cor)+'.csv', 'w', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerows(save_data_EF)
+            ax.plot(x_coordinates, EF, label='Silvaco Efield')
+            ax.plot(x_coordinates, EF2, label='DF-ISE Efield', linestyle='--')
+            ax.set_ylabel('Electric field [V/cm]')
+            ax.set_title('Electric field vs depth at ('+str(y_cor)+','+str(z_cor)+') um')
+            ax.legend()
+            # Add labels and title
+            ax.set_xlabel('X-coordinate/depth [um]')
+            ax.grid(True)
+            fig.savefig("EF_line("+str(y_cor)+'_'+str(z_cor)+").png")
+
+        elif(pltWP):
+            print("Test print of the last 5 pts in mesh: ",mesh_points_WP2[-5:].tolist(),"\n")
+            print("\n\nSILVACO\n\n")
+            WP = find_WP(weighting_pots, line, mesh_points_WP, input_files['mesh_Wpot'], options.interp)
+            print("\n\nDF-ISE\n\n")
+            WP2 = find_WP(weighting_pots2, line, mesh_points_WP2, input_files['mesh_WpotMorris'], options.interp) 
+            save_data_WP = list(zip(x_coordinates, WP2))
+            # Write Wpot data to a CSV file
+            with open('parsedWPdataVsDepth_at_'+str(y_cor)+'_'+str(z_cor)+'.csv', 'w', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerows(save_data_WP)
+            ax.plot(x_coordinates, WP, label='Silvaco weighting pot')
+            ax.plot(x_coordinates, WP2, label='DF-ISE weighting pot', linestyle='--')
+            ax.set_ylabel('Weighting potential [V]')
+            ax.set_title('Weighting potential vs depth at ('+str(y_cor)+','+str(z_cor)+') um')
+            ax.legend()
+            # Add labels and title
+            ax.set_xlabel('X-coordinate/depth [um]')
+            ax.grid(True)
+            fig.savefig("Wpot_line("+str(y_cor)+'_'+str(z_cor)+").png")
+            
+        elif(pltDop):
+            AbsDoping = find_doping(abs_doping, line, mesh_points_EF, input_files['mesh_EF'], options.interp)
+            BDoping = find_doping(B_doping, line, mesh_points_EF, input_files['mesh_EF'], options.interp)
+            PDoping = find_doping(P_doping, line, mesh_points_EF, input_files['mesh_EF'], options.interp)
+            # ax.plot(x_coordinates, AbsDoping, label='Absolute doping')
+            ax.plot(x_coordinates, BDoping, label='Boron doping')
+            ax.plot(x_coordinates, PDoping, label='Phosporous doping')
+            ax.set_ylabel('Doping concentration [cm^-3]')
+            ax.set_title('Doping concentration across a line through the center of a pixel')
+            ax.set_yscale('log')
+            ax.legend()
+            # Add labels and title
+            ax.set_xlabel('X-coordinate [um]')
+            ax.grid(True)
+            fig.savefig("Doping_line"+str(iter)+".png")
+        plt.close(fig)
+    return output.getvalue()
+
+# Define the line along which the electric field is to be plotted
+coordinates = []
+if(pltWP):
+    coordinates = [[110, 20], [43.875, 15.625], [11, 2], [20, 3], [100, 25]]
+elif(pltEF or pltDop):
+    # the doping concentrations are given on the electric field mesh
+    coordinates = [[11, 2], [17, 3], [2, 1], [23, 5]]
+
+# The meshes and values are read once; the search structures are built before the workers are forked,
+# which then share all of them copy-on-write
+meshes = []
+if(pltEF):
+    # Read the mesh and electric field files
+    mesh_points_EF = read_mesh(input_files['mesh_EF'])
+    electric_fields = read_EF(input_files['EF'])
+    mesh_points_EF2 = read_mesh(input_files['mesh_EFMorris'])
+    electric_fields2 = read_EF(input_files['EFMorris'])
+    meshes = [(input_files['mesh_EF'], mesh_points_EF), (input_files['mesh_EFMorris'], mesh_points_EF2)]
+elif(pltWP):
+    weighting_pots = read_WP(input_files['Wpot'])
+    mesh_points_WP = read_mesh(input_files['mesh_Wpot']) 
+    weighting_pots2 = read_WP(input_files['WpotMorris'])
+    mesh_points_WP2 = read_mesh(input_files['mesh_WpotMorris']) 
+    meshes = [(input_files['mesh_Wpot'], mesh_points_WP), (input_files['mesh_WpotMorris'], mesh_points_WP2)]
+elif(pltDop):
+    mesh_points_EF = read_mesh(input_files['mesh_EF'])
+    abs_doping = read_conc(input_files['Abs_dop_conc'])
+    B_doping = read_conc(input_files['B_conc'])
+    P_doping = read_conc(input_files['P_conc'])
+    meshes = [(input_files['mesh_EF'], mesh_points_EF)]
+for mesh_file, mesh_points in meshes:
+    mesh_tree(mesh_file, mesh_points)
+    if options.interp == 'linear':
+        mesh_triangulation(mesh_file, mesh_points)
 
-    # Create the plot
-    if(pltEF):
-        # Read the mesh and electric field files
-        mesh_points_EF = read_mesh('mesh_EF.txt')
-        electric_fields = read_EF('EF.txt')
-        mesh_points_EF2 = read_mesh('mesh_EFMorris.txt')
-        electric_fields2 = read_EF('EFMorris.txt')
-        print("\n\nSILVACO\n\n")
-        EF = find_EF(electric_fields, line, mesh_points_EF)
-        print("\n\nDF-ISE\n\n")
-        EF2 = find_EF(electric_fields2, line, mesh_points_EF2)
-        save_data_EF = list(zip(x_coordinates, EF))
-        # Write EF data to a CSV file
-        with open('parsedEFdataVsDepth_at_'+str(y_cor)+'_'+str(z_cor)+'.csv', 'w', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerows(save_data_EF)
-        plt.clf()
-        plt.plot(x_coordinates, EF, label='Silvaco Efield')
-        plt.plot(x_coordinates, EF2, label='DF-ISE Efield', linestyle='--')
-        plt.ylabel('Electric field [V/cm]')
-        plt.title('Electric field vs depth at ('+str(y_cor)+','+str(z_cor)+') um')
-        plt.legend()
-        # Add labels and title
-        plt.xlabel('X-coordinate/depth [um]')
-        plt.grid(True)
-        plt.savefig("EF_line("+str(y_cor)+'_'+str(z_cor)+").png")
-
-    elif(pltWP):
-        weighting_pots = read_WP('Wpot.txt')
-        mesh_points_WP = read_mesh('mesh_Wpot.txt') 
-        weighting_pots2 = read_WP('WpotMorris.txt')
-        mesh_points_WP2 = read_mesh('mesh_WpotMorris.txt') 
-        print("Test print of the last 5 pts in mesh: ",mesh_points_WP2[-5:],"\n")
-        print("\n\nSILVACO\n\n")
-        WP = find_WP(weighting_pots, line, mesh_points_WP)
-        print("\n\nDF-ISE\n\n")
-        WP2 = find_WP(weighting_pots2, line, mesh_points_WP2) 
-        save_data_WP = list(zip(x_coordinates, WP2))
-        # Write Wpot data to a CSV file
-        with open('parsedWPdataVsDepth_at_'+str(y_cor)+'_'+str(z_cor)+'.csv', 'w', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerows(save_data_WP)
-        plt.clf()
-        plt.plot(x_coordinates, WP, label='Silvaco weighting pot')
-        plt.plot(x_coordinates, WP2, label='DF-ISE weighting pot', linestyle='--')
-        plt.ylabel('Weighting potential [V]')
-        plt.title('Weighting potential vs depth at ('+str(y_cor)+','+str(z_cor)+') um')
-        plt.legend()
-        # Add labels and title
-        plt.xlabel('X-coordinate/depth [um]')
-        plt.grid(True)
-        plt.savefig("Wpot_line("+str(y_cor)+'_'+str(z_cor)+").png")
-        
-    elif(pltDop):
-        mesh_points_EF = read_mesh('mesh_EF.txt')
-        abs_doping = read_conc('Abs_dop_conc.csv')
-        B_doping = read_conc('B_conc.csv')
-        P_doping = read_conc('P_conc.csv')
-
-        AbsDoping = find_doping(abs_doping, line, mesh_points_EF)
-        BDoping = find_doping(B_doping, line, mesh_points_EF)
-        PDoping = find_doping(P_doping, line, mesh_points_EF)
-        # plt.plot(x_coordinates, AbsDoping, label='Absolute doping')
-        plt.plot(x_coordinates, BDoping, label='Boron doping')
-        plt.plot(x_coordinates, PDoping, label='Phosporous doping')
-        plt.ylabel('Doping concentration [cm^-3]')
-        plt.title('Doping concentration across a line through the center of a pixel')
-        plt.yscale('log')
-        plt.legend()
-        # Add labels and title
-        plt.xlabel('X-coordinate [um]')
-        plt.grid(True)
-        plt.savefig("Doping_line"+iter+".png")
+if options.cores > 1 and len(coordinates) > 1:
+    with multiprocessing.get_context('fork').Pool(min(options.cores, len(coordinates))) as pool:
+        outputs = pool.map(plot_line, range(len(coordinates)))
+else:
+    outputs = map(plot_line, range(len(coordinates)))
+for output in outputs:
+    print(output, end='')
 
 # elif(pltWP2d):
 #     data = pd.read_csv('../../50x12P5wgt/silvaco_final_weighting.out', delim_whitespace=True, header=None)